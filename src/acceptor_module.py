@@ -1,16 +1,78 @@
-import socket
 import _thread
 import os, sys
 import pickle
 import time
+import array
+import asyncio
+import wal_module
+import transport_module
 from event_module import *
 
 # Initial array sizes, double as needed for each reallocation
 ARRAY_INIT_SIZE = 8
 
+# Compact the write-ahead log every COMPACTION_FREQ seconds once it holds more than COMPACTION_MIN_RECORDS records
+COMPACTION_FREQ = 60
+COMPACTION_MIN_RECORDS = 10000
+
+# Messages shed first when the worker queue is full: a lost watermark is resent, a lost PROPOSE only delays an
+# election while a lost ACCEPT stalls a slot
+SHED_ORDER = ("WATERMARK", "PROPOSE", "PROPOSE_ALL")
+
+# Ballots (round, ID) for a sliding window of slots starting at base, stored as two parallel integer arrays
+# (round -1 marks an empty slot). Slots below base have been discarded
+class BallotWindow():
+	def __init__(self):
+		self.base = 0
+		self.rounds = array.array('q', [-1] * ARRAY_INIT_SIZE)
+		self.IDs = array.array('q', [-1] * ARRAY_INIT_SIZE)
+
+	# Return the ballot for a slot, None if it is empty or outside the window
+	def get(self, slot):
+		i = slot - self.base
+		if (i < 0) or (i >= len(self.rounds)) or (self.rounds[i] < 0):
+			return None
+		return (self.rounds[i], self.IDs[i])
+
+	# Set the ballot for a slot, slots below the window are ignored
+	def set(self, slot, n):
+		i = slot - self.base
+		if i < 0:
+			return
+		while len(self.rounds) - 1 < i:
+			self.extend()
+		self.rounds[i] = n[0]
+		self.IDs[i] = n[1]
+
+	# Return (slot, ballot) for every non-empty slot >= start
+	def items(self, start = 0):
+		items = []
+		for i in range(max(start - self.base, 0), len(self.rounds)):
+			if self.rounds[i] >= 0:
+				items.append((self.base + i, (self.rounds[i], self.IDs[i])))
+		return items
+
+	# Discard every slot below slot
+	def truncate(self, slot):
+		if slot <= self.base:
+			return
+		count = min(slot - self.base, len(self.rounds))
+		del self.rounds[:count]
+		del self.IDs[:count]
+		self.base = slot
+		if len(self.rounds) == 0:
+			self.extend()
+
+	# Extend the window to twice its size
+	def extend(self):
+		size = max(len(self.rounds), ARRAY_INIT_SIZE)
+		self.rounds.extend([-1] * size)
+		self.IDs.extend([-1] * size)
+
+
 # Acceptor Class
-class Acceptor():
-	def __init__(self, ID, server_config, local_run = False):
+class Acceptor(transport_module.Role):
+	def __init__(self, ID, server_config, local_run = False, runtime = None, transport = None):
 		self.ID = ID
 		self.server_config = server_config
 		self.local_run = local_run
@@ -22,55 +84,59 @@ class Acceptor():
 		# Lock for reading/writing to arrays
 		self.lock = _thread.allocate_lock()
 
-		# Number of messages for the listening thread to drop (used for debug purposes)
-		self.drop_counter = 0
+		# Messaging shared by every role: transport, tracer, sending and dropping messages
+		transport_module.Role.__init__(self, "ACCEPTOR", ID, server_config, local_run, transport)
 
-		# Arrays for the status of each round (load from disk if they exit)
+		# Arrays for the status of each round are rebuilt from the write-ahead log (if it exists).
+		# MAX_PREPARE_LIST is the pre-WAL promise file, only read once to carry promises over
 		self.filenames = {\
-		"MAX_PREPARE_LIST" : "acceptor_{}_MPL.log".format(ID), \
-		"ACC_NUM_LIST" : "acceptor_{}_ANL.log".format(ID), \
-		"ACC_VAL_LIST"  : "acceptor_{}_AVL.log".format(ID)}
+		"WAL" : "acceptor_{}_wal.log".format(ID), \
+		"MAX_PREPARE_LIST" : "acceptor_{}_MPL.log".format(ID)}
 
 		# Load state from disk if available
 		self.load_data()
 
-		# Persistent Sending Socket
-		self.send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # UDP
-
-		# Start listening thread for incoming messages
-		_thread.start_new_thread(self.listen, ())
+		# Write-ahead log of (slot, field, value) records, compacted to the current state at startup
+		self.wal = wal_module.WriteAheadLog(self.filenames["WAL"])
+		self.compact()
+		_thread.start_new_thread(self.compactor, ())
 
+		# Serve incoming messages on the node runtime's event loop if given, otherwise on a worker pool
+		self.serve(self.port, runtime, SHED_ORDER)
 
-	# Listen for incoming connections by binding to the socket specified in the hosts file
-	def listen(self):
-		try:
-			self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # UDP
-			self.sock.bind(('', self.port))
-			while True:
-				msg, source = self.sock.recvfrom(4096)
 
-				# Drop messages if requested to by the user
-				if self.drop_counter > 0:
-					self.drop_counter -= 1
-					continue
-
-				# Process message on a thread
-				_thread.start_new_thread(self.process_message, (msg, source,))
+	# Coroutine handling one datagram received by the node runtime, runs on the event loop without a thread
+	async def handle_datagram(self, msg, source):
+		if self.drop_requested(msg):
+			return
 
-		except:
-			# Restart listening thread
-			_thread.start_new_thread(self.listen, ())
+		# Reply once the state change is durable, without blocking the event loop on fsync
+		response = self.receive(msg, source)
+		if response is not None:
+			seq, dest, reply = response
+			await asyncio.wrap_future(self.wal.wait_future(seq))
+			self.send_msg(dest[0], dest[1], reply)
 
-	# Process the received message
+	# Process the received message, replying only once every state change it may reflect is on disk
 	def process_message(self, msg, source):
-		msg = pickle.loads(msg)
-
-		# Display Debug Information
+		response = self.receive(msg, source)
+		if response is not None:
+			seq, dest, reply = response
+			self.wal.wait(seq)
+			self.send_msg(dest[0], dest[1], reply)
+
+	# Update acceptor state for a received message. Return (WAL sequence number, destination, reply) when
+	# a reply is due, the reply may only be sent once the WAL is durable up to that sequence number
+	def receive(self, msg, source):
+		msg = self.decode(msg, source)
+		if msg is None:
+			return None
 		msg_type = msg["TYPE"]
-		s1 = "Server: [{}   {}]".format(self.ID, "ACCEPTOR")
-		s2 = "Status: [{} {}]".format("RECEIVED", msg_type)
-		s3 = "Source:      [{}:{}]".format(source[0], source[1])
-		print("{:<40} {:<40} {:<40}".format(s1, s2, s3))
+
+		# A server reports the slot below which its log is committed and durable
+		if msg_type == "WATERMARK":
+			self.set_watermark(msg["ID"], msg["SLOT"])
+			return None
 
 		# Extract info
 		if ("SLOT" in msg.keys()) and ("N" in msg.keys()) and ("ID" in msg.keys()):
@@ -78,138 +144,210 @@ class Acceptor():
 			n = msg["N"]
 			ID = msg["ID"]
 		else:
-			return
+			return None
+
+		# State below the cluster-wide watermark was discarded, those slots are decided everywhere
+		if slot < self.get_base_slot():
+			return None
 
-		# Respond to either propose or accept messages with potential promise/ack messages
+		# Replies go to the sender's proposer port
+		dest = (source[0], self.server_config[ID]["PROPOSER_PORT"])
+
+		# Respond to either propose or accept messages with potential promise/ack messages, and reject a
+		# stale ballot with a nack so the proposer does not wait for a promise/ack that will never come.
+		# Ballot (0, 0) only reads the slot's state
 		if msg_type == "PROPOSE":
-			if (self.get_max_prepare(slot) is None) or (n > self.get_max_prepare(slot)) or (n == (0, 0)):
-				if n != (0, 0):
-					self.set_max_prepare(slot, n)
-				source = (source[0], self.server_config[msg["ID"]]["PROPOSER_PORT"])
-				self.promise(slot, source)
+			if (n == (0, 0)) or self.try_promise(slot, n):
+				return (self.wal.last_sequence(), dest, self.promise(slot, n))
+			return (self.wal.last_sequence(), dest, self.nack(slot, n))
 		elif msg_type == "ACCEPT":
-			# Determine whether to send an ack message and update state
-			if (n==(0, 0) or (self.get_max_prepare(slot) is None) or (n >= self.get_max_prepare(slot))):
-				v = msg["EVENT"]
-				if n != (0, 0):
-					self.set_acc_num(slot, n)
-					self.set_acc_val(slot, v)
-					self.set_max_prepare(slot, n)
-				source = (source[0], self.server_config[msg["ID"]]["PROPOSER_PORT"])
-				# Send an ack message
-				self.ack(slot, source)
-
-	# Send a promise message
-	def promise(self, slot, dest):
-		acc_num = self.get_acc_num(slot)
-		acc_val = self.get_acc_val(slot)
-		msg = {"TYPE": "PROMISE", "SLOT": slot, "ACC_NUM": acc_num, "ACC_VAL": acc_val, "ID": self.ID}
-		self.send_msg(dest[0], dest[1], msg)
-
-
-	# Send an ack message
-	def ack(self, slot, dest):
-		acc_num, acc_val = self.get_acc_num(slot), self.get_acc_val(slot)
-		msg = {"TYPE": "ACK", "SLOT": slot, "ACC_NUM": acc_num, "ACC_VAL": acc_val, "ID": self.ID}
-		self.send_msg(dest[0], dest[1], msg)
-
-	# Given a destination IP and port, send a message
-	def send_msg(self, dest_ip, dest_port, message):
-		try:
-			# Display Debug Information
-			s1 = "Server: [{}   {}]".format(self.ID, "ACCEPTOR")
-			s2 = "Status: [{} {}]".format("SENDING", message["TYPE"])
-			s3 = "Destination: [{}:{}]".format(dest_ip, dest_port)
-			print("{:<40} {:<40} {:<40}".format(s1, s2, s3))
-
-			# Send Message
-			msg = pickle.dumps(message)
-			self.send_sock.sendto(msg, (dest_ip, dest_port))
-		except:
-			pass
-
-
-	# Get the max prepare value for a particular slot
-	def get_max_prepare(self, slot):
-		with self.lock:
-			# Return None if the slot is out of bounds (even definitely not present)
-			if slot >= len(self.max_prepare_list):
+			if (n == (0, 0)) or self.try_accept(slot, n, msg["EVENT"]):
+				return (self.wal.last_sequence(), dest, self.ack(slot, n))
+			return (self.wal.last_sequence(), dest, self.nack(slot, n))
+		elif msg_type == "PROPOSE_ALL":
+			# Multi-Paxos leader election: a single prepare covering every slot from SLOT onward
+			if n == (0, 0):
 				return None
-			return self.max_prepare_list[slot]
+			if not self.set_leader_prepare(slot, n):
+				return (self.wal.last_sequence(), dest, self.nack(slot, n))
+			return (self.wal.last_sequence(), dest, self.promise_all(slot, n))
+		return None
 
-	# Get the acc num for a particular slot
-	def get_acc_num(self, slot):
-		with self.lock:
-			# Return None if the slot is out of bounds (even definitely not present)
-			if slot >= len(self.acc_num_list):
-				return None
-			return self.acc_num_list[slot]
+	# Build a promise message
+	def promise(self, slot, n):
+		acc_num, acc_val = self.get_accepted(slot)
+		return {"TYPE": "PROMISE", "SLOT": slot, "N": n, "ACC_NUM": acc_num, "ACC_VAL": acc_val, "ID": self.ID}
 
-	# Get the acc val for a particular slot
-	def get_acc_val(self, slot):
-		with self.lock:
-			# Return None if the slot is out of bounds (even definitely not present)
-			if slot >= len(self.acc_val_list):
-				return None
-			return self.acc_val_list[slot]
 
-	# Given a slot and value, update the max prepare array
-	def set_max_prepare(self, slot, n):
+	# Build a promise message covering all slots >= slot, reporting every value accepted in that range
+	def promise_all(self, slot, n):
+		return {"TYPE": "PROMISE_ALL", "SLOT": slot, "N": n, "ACCEPTED": self.get_accepted_from(slot), "ID": self.ID}
+
+	# Build an ack message
+	def ack(self, slot, n):
+		acc_num, acc_val = self.get_accepted(slot)
+		return {"TYPE": "ACK", "SLOT": slot, "N": n, "ACC_NUM": acc_num, "ACC_VAL": acc_val, "ID": self.ID}
+
+	# Build a nack message rejecting ballot n for slot, reporting the highest ballot promised (for the slot
+	# or as a leader promise) for the proposer to jump above
+	def nack(self, slot, n):
 		with self.lock:
-			while len(self.max_prepare_list) - 1 < slot:
-				self.extend_max_prepare_list()
-			self.max_prepare_list[slot] = n
-			pickle.dump(self.max_prepare_list, open(self.filenames["MAX_PREPARE_LIST"], "wb" ))
+			max_prepare = self.promised(slot)
+			if (self.leader_prepare is not None) and ((max_prepare is None) or (self.leader_prepare[1] > max_prepare)):
+				max_prepare = self.leader_prepare[1]
+		return {"TYPE": "NACK", "SLOT": slot, "N": n, "MAX_PREPARE": max_prepare, "ID": self.ID}
+
+
+	# Return the highest ballot promised for a slot (caller holds the lock)
+	def promised(self, slot):
+		n = self.max_prepare.get(slot)
+		if (self.leader_prepare is not None) and (slot >= self.leader_prepare[0]):
+			if (n is None) or (self.leader_prepare[1] > n):
+				n = self.leader_prepare[1]
+		return n
+
+	# Promise ballot n for a slot unless a higher ballot was promised, checked and recorded under one lock
+	# hold so concurrent proposals cannot both pass the check. Return True if n was promised
+	def try_promise(self, slot, n):
+		with self.lock:
+			promised = self.promised(slot)
+			if (promised is not None) and (n <= promised):
+				return False
+			self.max_prepare.set(slot, n)
+			self.wal.append((slot, "MAX_PREPARE", n))
+			return True
+
+	# Accept v with ballot n for a slot unless a higher ballot was promised, checked and recorded under one
+	# lock hold. Return True if v was accepted
+	def try_accept(self, slot, n, v):
+		with self.lock:
+			promised = self.promised(slot)
+			if (promised is not None) and (n < promised):
+				return False
+			self.acc_num.set(slot, n)
+			self.wal.append((slot, "ACC_NUM", n))
+			if slot >= self.acc_num.base:
+				self.acc_val[slot] = v
+			self.wal.append((slot, "ACC_VAL", v))
+			self.max_prepare.set(slot, n)
+			self.wal.append((slot, "MAX_PREPARE", n))
+			return True
+
+	# Return (acc num, acc val) for a slot, read together
+	def get_accepted(self, slot):
+		with self.lock:
+			return self.acc_num.get(slot), self.acc_val.get(slot)
 
-	# Given a slot and value, update the acc num array
-	def set_acc_num(self, slot, n):
+	# Return {slot: (acc num, acc val)} for every accepted value in slots >= slot
+	def get_accepted_from(self, slot):
+		with self.lock:
+			accepted = dict()
+			for acc_slot, acc_num in self.acc_num.items(slot):
+				accepted[acc_slot] = (acc_num, self.acc_val.get(acc_slot))
+			return accepted
+
+	# Promise ballot n for every slot >= slot, return False if a ballot at least as high was already promised
+	# for slot or as a leader. The new promise keeps covering the lower of the two starting slots so earlier
+	# promises are never weakened
+	def set_leader_prepare(self, slot, n):
 		with self.lock:
-			while len(self.acc_num_list) - 1 < slot:
-				self.extend_acc_num_list()
-			self.acc_num_list[slot] = n
-			pickle.dump(self.max_prepare_list, open(self.filenames["ACC_NUM_LIST"], "wb" ))
+			max_prepare = self.max_prepare.get(slot)
+			if (max_prepare is not None) and (n <= max_prepare):
+				return False
+			if self.leader_prepare is not None:
+				if n <= self.leader_prepare[1]:
+					return False
+				slot = min(slot, self.leader_prepare[0])
+			self.leader_prepare = (slot, n)
+			self.wal.append((slot, "LEADER_PREPARE", n))
+			return True
+
+	# Return the first slot this acceptor still keeps state for
+	def get_base_slot(self):
+		with self.lock:
+			return self.acc_num.base
 
-	# Given a slot and value, update the acc val array
-	def set_acc_val(self, slot, v):
+	# Record a server's watermark and discard state below the cluster-wide watermark (the lowest watermark
+	# reported by every server), all of those slots are committed and durable on every server
+	def set_watermark(self, ID, slot):
 		with self.lock:
-			while len(self.acc_val_list) - 1 < slot:
-				self.extend_acc_val_list()
-			self.acc_val_list[slot] = v
-			pickle.dump(self.max_prepare_list, open(self.filenames["ACC_VAL_LIST"], "wb" ))
-
-	# Extend the Max Prepare list to twice it's size
-	def extend_max_prepare_list(self):
-		size = len(self.max_prepare_list)
-		self.max_prepare_list.extend([None] * size)
-
-	# Extend the Accepted Number list to twice it's size
-	def extend_acc_num_list(self):
-		size = len(self.acc_num_list)
-		self.acc_num_list.extend([None] * size)
-
-	# Extend the Accepted Value list to twice it's size
-	def extend_acc_val_list(self):
-		size = len(self.acc_val_list)
-		self.acc_val_list.extend([None] * size)
-
-	# Load state off of disk if available
+			if slot <= self.watermarks.get(ID, -1):
+				return
+			self.watermarks[ID] = slot
+			if len(self.watermarks) < len(self.server_config):
+				return
+			watermark = min(self.watermarks.values())
+			if watermark <= self.acc_num.base:
+				return
+			self.truncate(watermark)
+			self.wal.append((watermark, "TRUNCATE", None))
+		self.tracer.info("DISCARDED STATE", SLOT = watermark + 1)
+
+	# Discard all state for slots below slot (caller holds the lock)
+	def truncate(self, slot):
+		self.max_prepare.truncate(slot)
+		self.acc_num.truncate(slot)
+		for acc_slot in [acc_slot for acc_slot in self.acc_val if acc_slot < slot]:
+			del self.acc_val[acc_slot]
+
+	# Load state off of disk if available by replaying the write-ahead log
 	def load_data(self):
-		if os.path.isfile(self.filenames["MAX_PREPARE_LIST"]):
-			self.max_prepare_list = pickle.load(open(self.filenames["MAX_PREPARE_LIST"], "rb" ))
-		else:
-			self.max_prepare_list = [None] * ARRAY_INIT_SIZE
-			
-		if os.path.isfile(self.filenames["ACC_NUM_LIST"]):
-			self.acc_num_list = pickle.load(open(self.filenames["ACC_NUM_LIST"], "rb" ))
-		else:
-			self.acc_num_list = [None] * ARRAY_INIT_SIZE
-			
-		if os.path.isfile(self.filenames["ACC_VAL_LIST"]):
-			self.acc_val_list = pickle.load(open(self.filenames["ACC_VAL_LIST"], "rb" ))
-		else:
-			self.acc_val_list = [None] * ARRAY_INIT_SIZE
-
-
-	# Drop the requested number of messages in the listening thread
-	def drop_messages(self, num_messages):
-		self.drop_counter = num_messages
+		self.max_prepare = BallotWindow()
+		self.acc_num = BallotWindow()
+		self.acc_val = dict()
+		self.leader_prepare = None
+		self.watermarks = dict()
+
+		# Carry promises over from the pre-WAL file format the first time
+		if (not os.path.isfile(self.filenames["WAL"])) and os.path.isfile(self.filenames["MAX_PREPARE_LIST"]):
+			max_prepare_list = pickle.load(open(self.filenames["MAX_PREPARE_LIST"], "rb" ))
+			for slot in range(len(max_prepare_list)):
+				if max_prepare_list[slot] is not None:
+					self.max_prepare.set(slot, max_prepare_list[slot])
+
+		for slot, field, value in wal_module.read_records(self.filenames["WAL"]):
+			self.apply_record(slot, field, value)
+
+	# Apply a single (slot, field, value) record to the in-memory state
+	def apply_record(self, slot, field, value):
+		if field == "LEADER_PREPARE":
+			self.leader_prepare = (slot, value)
+		elif field == "TRUNCATE":
+			self.truncate(slot)
+		elif field == "MAX_PREPARE":
+			self.max_prepare.set(slot, value)
+		elif field == "ACC_NUM":
+			self.acc_num.set(slot, value)
+		elif (field == "ACC_VAL") and (slot >= self.acc_num.base):
+			self.acc_val[slot] = value
+
+	# Return the current state as a list of (slot, field, value) records
+	def get_records(self):
+		records = [(self.acc_num.base, "TRUNCATE", None)]
+		for slot, n in self.max_prepare.items():
+			records.append((slot, "MAX_PREPARE", n))
+		for slot, n in self.acc_num.items():
+			records.append((slot, "ACC_NUM", n))
+		for slot in sorted(self.acc_val):
+			records.append((slot, "ACC_VAL", self.acc_val[slot]))
+		if self.leader_prepare is not None:
+			records.append((self.leader_prepare[0], "LEADER_PREPARE", self.leader_prepare[1]))
+		return records
+
+	# Rewrite the write-ahead log as one record per live field. Only copying the state holds the lock, the
+	# file is written while messages keep being served
+	def compact(self):
+		self.wal.rewrite(self.snapshot_records)
+
+	# Return the current state's records and the sequence number of the last WAL record they reflect
+	def snapshot_records(self):
+		with self.lock:
+			return self.get_records(), self.wal.last_sequence()
+
+	# Thread that periodically compacts the write-ahead log
+	def compactor(self):
+		while True:
+			time.sleep(COMPACTION_FREQ)
+			if self.wal.records > COMPACTION_MIN_RECORDS:
+				self.tracer.info("COMPACTING WAL", RECORDS = self.wal.records)
+				self.compact()
@@ -6,7 +6,8 @@ class Tweet():
 	def __init__(self, username, message):
 		self.username = username
 		self.message = message
-		self.utc_time = time_mod.asctime(time_mod.gmtime())
+		self.timestamp = time_mod.time()
+		self.utc_time = time_mod.asctime(time_mod.gmtime(self.timestamp))
 		
 		
 	# Return string representation of a tweet object
@@ -17,9 +18,9 @@ class Tweet():
 	def __hash__(self):
 		return hash("{}::{}::{}".format(self.username, self.message, self.utc_time))
 		
-	# Order tweets by UTC time
+	# Order tweets by creation time
 	def __lt__(self, other):
-		return self.utc_time < other.utc_time
+		return self.get_timestamp() < other.get_timestamp()
 		
 	# Determine if two Tweet objects are the same
 	def __eq__(self, other):
@@ -38,6 +39,13 @@ class Tweet():
 		
 	    return time_mod.asctime(loc_struct)
 		
+	# Return the creation time in seconds since the epoch (tweets created before timestamps
+	# were recorded fall back to their 1-second resolution UTC string)
+	def get_timestamp(self):
+		if not hasattr(self, "timestamp"):
+			self.timestamp = float(calendar.timegm(time_mod.strptime(self.utc_time, '%a %b %d %H:%M:%S %Y')))
+		return self.timestamp
+
 	# Return whether self is a certain object type
 	def is_type(self, object_type):
 		return type(self) is object_type
@@ -117,4 +125,94 @@ class DeleteBlock():
 		
 	# Return the corresponding InsertBlock for this DeleteBlock
 	def convert_to_IB(self):
-		return InsertBlock(self.username, self.follower)
\ No newline at end of file
+		return InsertBlock(self.username, self.follower)
+
+# Batch Object (several events committed together in a single slot)
+class Batch():
+	# username = user whose proposer built the batch
+	# events   = list of Tweet / InsertBlock / DeleteBlock objects, applied in order
+	def __init__(self, username, events):
+		self.username = username
+		self.events = events
+
+	# Return string representation of a batch object
+	def __str__(self):
+		return "Batch [{}]".format(" | ".join([str(event) for event in self.events]))
+
+	# Return the hash for a Batch object
+	def __hash__(self):
+		return hash(tuple(self.events))
+
+	# Determine if two Batch objects are the same
+	def __eq__(self, other):
+		return isinstance(other, Batch) and (self.username == other.username and self.events == other.events)
+
+	# Return whether self is a certain object type
+	def is_type(self, object_type):
+		return type(self) is object_type
+
+	# Return the list of events contained in the batch
+	def unpack(self):
+		return self.events
+
+	# Return the username which created this object
+	def get_username(self):
+		return self.username
+
+# Forwarded Object (an event forwarded to the leader, applied once whichever slots it is committed in)
+class Forwarded():
+	# key   = (server ID, incarnation, sequence number) the forwarding server gave the event
+	# event = Tweet / InsertBlock / DeleteBlock object
+	def __init__(self, key, event):
+		self.key = key
+		self.event = event
+
+	# Return string representation of a forwarded object
+	def __str__(self):
+		return str(self.event)
+
+	# Return the hash for a Forwarded object
+	def __hash__(self):
+		return hash(self.key)
+
+	# Determine if two Forwarded objects are the same
+	def __eq__(self, other):
+		return isinstance(other, Forwarded) and (self.key == other.key and self.event == other.event)
+
+	# Return whether self is a certain object type
+	def is_type(self, object_type):
+		return type(self) is object_type
+
+	# Return the forwarded event
+	def unpack(self):
+		return self.event
+
+	# Return the username which created this object
+	def get_username(self):
+		return self.event.get_username()
+
+# No-op Object (fills a slot abandoned undecided, so the log has no permanent hole)
+class NoOp():
+	# Return string representation of a no-op object
+	def __str__(self):
+		return "No-op"
+
+	# Return the hash for a NoOp object
+	def __hash__(self):
+		return hash("NOOP")
+
+	# Every NoOp object is the same
+	def __eq__(self, other):
+		return isinstance(other, NoOp)
+
+	# Return whether self is a certain object type
+	def is_type(self, object_type):
+		return type(self) is object_type
+
+	# Return self since already unpacked
+	def unpack(self):
+		return self
+
+	# A no-op was not created by any user
+	def get_username(self):
+		return None
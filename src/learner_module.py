@@ -1,13 +1,22 @@
-import socket
 import _thread
+import asyncio
 import os, sys, traceback
-import pickle
 import time
+import wire_module
+import transport_module
 from event_module import *
 
+# Catch-up: entries and state are streamed to a lagging server in datagrams of about CATCHUP_CHUNK_BYTES
+# encoded bytes (under the receive buffer size), CATCHUP_CHUNK_DELAY seconds apart
+CATCHUP_CHUNK_BYTES = 3072
+CATCHUP_CHUNK_DELAY = 0.001
+
+# Messages shed first when the worker queue is full: a lagging server asks again, a lost COMMIT leaves a hole
+SHED_ORDER = ("CATCHUP_REQUEST",)
+
 # Learner Class
-class Learner():
-	def __init__(self, ID, server_config, log, local_run = False):
+class Learner(transport_module.Role):
+	def __init__(self, ID, server_config, log, local_run = False, runtime = None, transport = None):
 		self.ID = ID
 		self.server_config = server_config
 		self.log = log
@@ -17,69 +26,115 @@ class Learner():
 		self.IP = server_config[ID]["IP"]
 		self.port = server_config[ID]["LEARNER_PORT"]
 
-		# Number of messages for the listening thread to drop (used for debug purposes)
-		self.drop_counter = 0
-
-		# Persistent Sending Socket
-		self.send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # UDP
-
-		# Start listening thread for incoming messages
-		_thread.start_new_thread(self.listen, ())
-
+		# Messaging shared by every role: transport, tracer, sending and dropping messages
+		transport_module.Role.__init__(self, "LEARNER", ID, server_config, local_run, transport)
 
-	# Listen for incoming connections by binding to the socket specified in the hosts file
-	def listen(self):
-		try:
-			self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # UDP
-			self.sock.bind(('', self.port))
-			while True:
-				msg, source = self.sock.recvfrom(4096)
+		# State being received from a peer during catch-up: ID -> (slot, {chunk number: data})
+		self.state_chunks = dict()
 
-				# Drop messages if requested to by the user
-				if self.drop_counter > 0:
-					self.drop_counter -= 1
-					continue
+		# Serve incoming messages on the node runtime's event loop if given, otherwise on a worker pool
+		self.serve(self.port, runtime, SHED_ORDER)
 
-				# Process message on a thread
-				_thread.start_new_thread(self.process_message, (msg, source,))
 
-		except:
-			traceback.print_exc(file=sys.stdout)
-			# Restart listening thread
-			_thread.start_new_thread(self.listen, ())
+	# Coroutine handling one datagram received by the node runtime, runs on the event loop without a thread
+	async def handle_datagram(self, msg, source):
+		if self.drop_requested(msg):
+			return
 
-	# Process the received message
-	def process_message(self, msg, source):
-		msg = pickle.loads(msg)
+		# Let the event loop serve other commits while this one is fsynced, so they share the fsync
+		seq = self.process_message(msg, source, wait = False)
+		if (seq is not None) and (self.log.durability == "COMMIT"):
+			await asyncio.wrap_future(self.log.durable_future(seq))
 
-		# Display Debug Information
+	# Process the received message, return the log sequence number of a committed entry (None otherwise).
+	# wait is False when the caller waits for the entry to be durable itself
+	def process_message(self, msg, source, wait = True):
+		msg = self.decode(msg, source)
+		if msg is None:
+			return None
 		msg_type = msg["TYPE"]
-		s1 = "Server: [{}   {}]".format(self.ID, " LEARNER")
-		s2 = "Status: [{} {}]".format("RECEIVED", msg_type)
-		s3 = "Source:      [{}:{}]".format(source[0], source[1])
-		print("{:<40} {:<40} {:<40}".format(s1, s2, s3))
 
 		# If the received message is a commit message, pass it to the log
 		if msg_type == "COMMIT":
 			slot = msg["SLOT"]
 			event = msg["EVENT"]
-			self.log.set_entry(slot, event)
-
-	# Given a destination IP and port, send a message
-	def send_msg(self, dest_ip, dest_port, message):
-		try:
-			# Display Debug Information
-			s1 = "Server: [{}   {}]".format(self.ID, " LEARNER")
-			s2 = "Status: [{} {}]".format("SENDING", message["TYPE"])
-			s3 = "Destination: [{}:{}]".format(dest_ip, dest_port)
-			print("{:<40} {:<40} {:<40}".format(s1, s2, s3))
-
-			# Send Message
-			msg = pickle.dumps(message)
-			self.send_sock.sendto(msg, (dest_ip, dest_port))
-		except:
-			pass
-
-	# Drop the requested number of messages in the listening thread
-	def drop_messages(self, num_messages):
-		self.drop_counter = num_messages
+			return self.log.set_entry(slot, event, wait)
+
+		# A lagging server asks for committed entries, stream them on a thread
+		elif msg_type == "CATCHUP_REQUEST":
+			_thread.start_new_thread(self.send_catchup, (msg,))
+
+		# Committed entries streamed by a peer, only the last one is waited on
+		elif msg_type == "CATCHUP_ENTRIES":
+			seq = None
+			for slot, event in msg["ENTRIES"]:
+				seq = self.log.set_entry(slot, event, False) or seq
+			if (seq is not None) and wait and (self.log.durability == "COMMIT"):
+				self.log.wait_durable(seq)
+			return seq
+
+		# Part of a peer's state, install it once every chunk arrived
+		elif msg_type == "CATCHUP_STATE":
+			self.receive_state_chunk(msg)
+
+	# Stream the committed entries in [SLOT, END) (END None for all) to the requesting learner, followed by
+	# a CATCHUP_DONE for its proposer. When an entry was compacted away, our whole state is sent instead
+	def send_catchup(self, msg):
+		ID = msg["ID"]
+		start = msg["SLOT"]
+		end = self.log.get_next_available_slot()
+		if msg["END"] is not None:
+			end = min(msg["END"], end)
+
+		entries = []
+		size = 0
+		for slot in range(start, end):
+			event = self.log.get_entry(slot)
+			if event is None:
+				if self.log.is_filled(slot):
+					self.send_state(ID)
+					break
+				continue
+
+			# Send the chunk once the next entry would not fit
+			entry_size = len(wire_module.encode_value(event))
+			if (len(entries) > 0) and (size + entry_size > CATCHUP_CHUNK_BYTES):
+				self.send_catchup_msg(ID, "LEARNER_PORT", {"TYPE": "CATCHUP_ENTRIES", "ENTRIES": entries, "ID": self.ID})
+				entries = []
+				size = 0
+			entries.append((slot, event))
+			size += entry_size
+
+		if len(entries) > 0:
+			self.send_catchup_msg(ID, "LEARNER_PORT", {"TYPE": "CATCHUP_ENTRIES", "ENTRIES": entries, "ID": self.ID})
+
+		# Tell the requester where our log ends and up to which slot it is complete
+		msg = {"TYPE": "CATCHUP_DONE", "SLOT": start, "N": None, "END": end, "PREFIX": self.log.get_contiguous_prefix(), "ID": self.ID}
+		self.send_catchup_msg(ID, "PROPOSER_PORT", msg)
+
+	# Send our state to the learner of server ID in chunks
+	def send_state(self, ID):
+		state = self.log.get_state()
+		data = wire_module.encode_value(state)
+		chunks = [data[i:i + CATCHUP_CHUNK_BYTES] for i in range(0, len(data), CATCHUP_CHUNK_BYTES)]
+		for i in range(len(chunks)):
+			msg = {"TYPE": "CATCHUP_STATE", "SLOT": state["CONTIGUOUS_PREFIX"], "CHUNK": i, "CHUNKS": len(chunks), "DATA": chunks[i], "ID": self.ID}
+			self.send_catchup_msg(ID, "LEARNER_PORT", msg)
+
+	# Send a catch-up message to one of server ID's ports, paced so the stream does not overrun its buffers
+	def send_catchup_msg(self, ID, port, msg):
+		self.send_msg(self.server_config[ID]["IP"], self.server_config[ID][port], msg)
+		time.sleep(CATCHUP_CHUNK_DELAY)
+
+	# Store a chunk of a peer's state, install the state in the log once every chunk was received
+	def receive_state_chunk(self, msg):
+		ID = msg["ID"]
+		if (ID not in self.state_chunks) or (self.state_chunks[ID][0] != msg["SLOT"]):
+			self.state_chunks[ID] = (msg["SLOT"], dict())
+		chunks = self.state_chunks[ID][1]
+		chunks[msg["CHUNK"]] = msg["DATA"]
+
+		if len(chunks) == msg["CHUNKS"]:
+			del self.state_chunks[ID]
+			state = wire_module.decode_value(b"".join([chunks[i] for i in range(msg["CHUNKS"])]))
+			self.log.install_state(state)
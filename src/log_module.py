@@ -1,158 +1,648 @@
 import os, sys
 from event_module import *
 import _thread
+import threading
+import time
 import pickle
+import bisect
+import struct
+import mmap
+import heapq
+import concurrent.futures
+import trace_module
 
 
 ARRAY_INIT_SIZE = 8
 
+# Number of tweets shown per timeline page
+TIMELINE_PAGE_SIZE = 20
+
+# Take a snapshot after SNAPSHOT_INTERVAL commits, or every SNAPSHOT_FREQ seconds if anything was committed
+SNAPSHOT_INTERVAL = 1000
+SNAPSHOT_FREQ = 300
+
+# Number of records per event log segment, and how many segments fully covered by the snapshot are kept
+# on disk (for serving old slots to peers) before being deleted
+SEGMENT_SIZE = 10000
+SEGMENTS_RETAINED = 4
+
+# When committed entries reach the disk:
+# "COMMIT"   -> set_entry returns once its entry is fsynced (concurrent commits share one fsync)
+# "INTERVAL" -> fsync at most every DURABILITY_INTERVAL seconds, a crash may lose the last interval
+# "OS"       -> never fsync, the operating system decides when to write back
+DURABILITY = "COMMIT"
+DURABILITY_INTERVAL = 0.01
+
+# Number of most recently applied forwarded event keys remembered, a forwarded event committed again (in another
+# slot, by another leader) within that many forwarded events is not applied twice
+FORWARD_KEYS_RETAINED = 16384
+
+# Segment index record: (slot, byte offset of the record in the segment)
+INDEX_RECORD = struct.Struct("<qq")
+
 # Log Class
 class Log():
-	def __init__(self, ID, server_config, username):
+	def __init__(self, ID, server_config, username, snapshot_interval = SNAPSHOT_INTERVAL, snapshot_freq = SNAPSHOT_FREQ, durability = DURABILITY, durability_interval = DURABILITY_INTERVAL):
 		print("{:-^120}".format("INITIALIZING LOG"))
 
 		self.ID = ID
 		self.server_config = server_config
 		self.filenames = {\
 		"LOG" : "server_{}_log.log".format(ID), \
-		"TIMELINE" : "server_{}_timeline.log".format(ID),\
-		"BLOCKLIST" : "server_{}_blocklist.log".format(ID),}
+		"SEGMENT" : "server_{}_log.{{}}.log".format(ID), \
+		"INDEX" : "server_{}_log.{{}}.idx".format(ID), \
+		"SNAPSHOT" : "server_{}_snapshot.log".format(ID)}
 		self.lock = _thread.allocate_lock()
+		self.state_lock = threading.RLock()
 		self.username = username
-		self.checkpoint = 0
+
+		# Trace messages for entries added, snapshots and installed state
+		self.tracer = trace_module.Tracer("LOG", ID)
+
+		# Slot bookkeeping maintained on every insertion:
+		# next_available_slot -> slot after the last filled entry (high-water mark)
+		# contiguous_prefix   -> every slot below it is filled (not necessarily fsynced yet)
+		# holes               -> empty slots below the high-water mark
+		self.next_available_slot = 0
+		self.contiguous_prefix = 0
+		self.holes = set()
+
+		# Set whenever a commit leaves new holes behind it (waited on by the proposer's hole filler)
+		self.holes_detected = threading.Event()
 
 		# Initialize log, timeline, and block list
+		# Tweets are identified by the key (timestamp, slot, index in batch)
+		# timeline         -> {key: Tweet} of tweets viewable by this user
+		# timeline_keys    -> sorted list of the timeline's keys (oldest first)
+		# tweets_by_author -> {username: {key: Tweet}} of every committed tweet
+		# blocks           -> set of InsertBlock, hashed on (blocker, blockee) so lookups are O(1)
 		self.events_log = [None] * ARRAY_INIT_SIZE
-		self.timeline = []
+		self.timeline = dict()
+		self.timeline_keys = []
+		self.tweets_by_author = dict()
 		self.blocks = set()
 
-		# Recover from files if they exist
-		if os.path.isfile(self.filenames["TIMELINE"]):
-			self.timeline = pickle.load(open(self.filenames["TIMELINE"], "rb" ))
-		if os.path.isfile(self.filenames["BLOCKLIST"]):
-			self.blocks = pickle.load(open(self.filenames["BLOCKLIST"], "rb" ))
-		if os.path.isfile(self.filenames["LOG"]):
-			self.load_log()
-
-		print("[LOG] Checkpoint:", self.checkpoint)
+		# Authors whose tweet dict is shared with a copy of the state (get_state), copied before it next changes
+		self.shared_authors = set()
+
+		# Keys of the forwarded events applied, oldest first: key -> None
+		self.forward_keys = dict()
+
+		# Oldest key shown by the last timeline page, the next page starts before it
+		self.timeline_cursor = None
+
+		# On-disk event log segments: segment number -> highest slot it holds, and the segment being appended to
+		# (with its record count and size in bytes). Each segment has an index file of INDEX_RECORDs
+		self.segments = dict()
+		self.segment = 0
+		self.segment_records = 0
+		self.segment_bytes = 0
+
+		# Segment and byte offset the latest snapshot was taken at, recovery only reads the log after it
+		self.snapshot_position = None
+
+		# Segments whose index is sorted by slot (sealed ones), entries not in memory are found by binary search
+		# in their memory-mapped index. events_log only holds entries read or committed since boot
+		self.sorted_indexes = set()
+
+		# Buffered writer: (segment, record, index record) waiting for the writer thread, and the sequence
+		# numbers of the last appended, written and fsynced records
+		self.durability = durability
+		self.durability_interval = durability_interval
+		self.write_condition = threading.Condition(self.lock)
+		self.pending = []
+		self.appended = 0
+		self.written = 0
+		self.durable = 0
+		self.sync_requested = False
+
+		# Heap of (sequence number, tie breaker, future) resolved once the sequence number is fsynced
+		self.waiters = []
+		self.waiter_count = 0
+
+		# Snapshots: every slot below snapshot_slot is covered by the latest snapshot
+		self.snapshot_slot = 0
+		self.snapshot_interval = snapshot_interval
+		self.snapshot_freq = snapshot_freq
+		self.commits_since_snapshot = 0
+		self.snapshot_requested = threading.Event()
+
+		# Recover from the latest snapshot and the log segments written after it
+		self.load_snapshot()
+		self.load_log()
+
+		self.tracer.info("RECOVERED", SNAPSHOT_SLOT = self.snapshot_slot, NEXT_AVAILABLE_SLOT = self.next_available_slot)
 		print("-" * 120)
 
+		# Start the log writer and the background snapshot thread
+		_thread.start_new_thread(self.writer, ())
+		_thread.start_new_thread(self.snapshotter, ())
+
+
+	# Load the latest snapshot (tweets, blocklist and which slots it already applied) if one exists
+	def load_snapshot(self):
+		if not os.path.isfile(self.filenames["SNAPSHOT"]):
+			return
+
+		snapshot = pickle.load(open(self.filenames["SNAPSHOT"], "rb" ))
 
-	# Load the log from disk and replay leftover events into timeline and blocklist
+		# Snapshots without a log position cannot tell which records they cover, rebuild from the full log
+		if "POSITION" not in snapshot:
+			return
+
+		self.tweets_by_author = snapshot["TWEETS_BY_AUTHOR"]
+		self.blocks = snapshot["BLOCKS"]
+		self.forward_keys = dict.fromkeys(snapshot.get("FORWARD_KEYS", []))
+		self.rebuild_timeline()
+		self.snapshot_slot = snapshot["CONTIGUOUS_PREFIX"]
+		self.contiguous_prefix = snapshot["CONTIGUOUS_PREFIX"]
+		self.next_available_slot = snapshot["NEXT_AVAILABLE_SLOT"]
+		self.holes = snapshot["HOLES"]
+		self.segments = snapshot["SEGMENTS"]
+		self.snapshot_position = snapshot["POSITION"]
+
+	# Read the log written after the snapshot position and replay it. Older segments are not read, their
+	# entries are loaded on demand through the segment indexes
 	def load_log(self):
-		# open the file of current server for write
-		f = open(self.filenames["LOG"], 'rb')
+		# The pre-segment log file becomes the first segment
+		if os.path.isfile(self.filenames["LOG"]) and not os.path.isfile(self.filenames["SEGMENT"].format(0)):
+			os.rename(self.filenames["LOG"], self.filenames["SEGMENT"].format(0))
+
+		segments = self.list_segments()
+		self.segments = dict([(segment, self.segments.get(segment, -1)) for segment in segments])
+		if self.snapshot_position is None:
+			self.snapshot_position = (segments[0] if len(segments) > 0 else 0, 0)
+		start_segment, start_offset = self.snapshot_position
+
+		# Entries below the snapshot's high-water mark stay on disk until requested
+		while len(self.events_log) < self.next_available_slot:
+			self.extend_events_log()
 
 		replay_events = []
-		while True:
-			# unpickle each pickle container until reach the end
-			try:
-				slot, event = pickle.load(f)
-				self.checkpoint += 1
-				if self.checkpoint % 5 == 0:
-					replay_events = []
-				else:
-					replay_events.append(event)
+		for segment in segments:
+			if segment < start_segment:
+				continue
+			offset = start_offset if segment == start_segment else 0
+			replay_events.extend(self.recover_segment(segment, offset))
+			self.segment = segment
+
+		# Replay events committed after the snapshot was taken
+		self.replay(replay_events)
 
+		# Every segment but the one appended to is sealed, its index can be sorted
+		for segment in segments[:-1]:
+			self.sort_index(segment)
 
-				# extend events_log when needed
-				while len(self.events_log) - 1 < slot:
-					self.extend_events_log()
-				self.events_log[slot] = event
+	# Read the records of a segment from offset on, rebuild its index from there and cut off a torn record
+	# left by a crash. Return the (slot, event) pairs read
+	def recover_segment(self, segment, offset):
+		index = [entry for entry in self.read_index(segment) if entry[1] < offset]
+		events = []
 
+		# open the segment file and unpickle each pickle container until reach the end
+		f = open(self.filenames["SEGMENT"].format(segment), 'r+b')
+		f.seek(offset)
+		while True:
+			try:
+				slot, event = pickle.load(f)
 			except EOFError:
 				break
+			except (pickle.UnpicklingError, ValueError, AttributeError, IndexError):
+				self.tracer.warning("IGNORING TORN RECORD", SEGMENT = segment)
+				break
+			index.append((slot, offset))
+			offset = f.tell()
+			self.segments[segment] = max(self.segments[segment], slot)
+
+			# extend events_log when needed
+			while len(self.events_log) - 1 < slot:
+				self.extend_events_log()
+			self.events_log[slot] = event
+			self.track_slot(slot)
+			events.append((slot, event))
+		f.truncate(offset)
 		f.close()
 
-		# Replay events (up to 4 of the latest events from the log file)
-		self.replay(replay_events)
+		f = open(self.filenames["INDEX"].format(segment), 'wb')
+		f.write(b"".join([INDEX_RECORD.pack(slot, position) for slot, position in index]))
+		f.close()
 
-	# Replay a given list of events
+		self.segment_records = len(index)
+		self.segment_bytes = offset
+		return events
+
+	# Return the (slot, offset) pairs of a segment's index, read through a memory map
+	def read_index(self, segment):
+		filename = self.filenames["INDEX"].format(segment)
+		if (not os.path.isfile(filename)) or (os.path.getsize(filename) < INDEX_RECORD.size):
+			return []
+		with open(filename, 'rb') as f:
+			with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as index:
+				size = len(index) - len(index) % INDEX_RECORD.size
+				return list(INDEX_RECORD.iter_unpack(index[:size]))
+
+	# Sort the index of a sealed segment by slot (records are appended in commit order), replacing it atomically
+	def sort_index(self, segment):
+		index = self.read_index(segment)
+		if any([index[i][0] > index[i + 1][0] for i in range(len(index) - 1)]):
+			temp_filename = self.filenames["INDEX"].format(segment) + ".tmp"
+			f = open(temp_filename, 'wb')
+			f.write(b"".join([INDEX_RECORD.pack(slot, position) for slot, position in sorted(index)]))
+			f.flush()
+			os.fsync(f.fileno())
+			f.close()
+			os.replace(temp_filename, self.filenames["INDEX"].format(segment))
+		with self.lock:
+			self.sorted_indexes.add(segment)
+
+	# Return the byte offset of slot's record in a segment from its memory-mapped index (None if it is not
+	# there), binary searching a sorted index and scanning the one still appended to
+	def search_index(self, segment, slot, is_sorted):
+		try:
+			f = open(self.filenames["INDEX"].format(segment), 'rb')
+		except OSError:
+			return None
+		with f:
+			if os.fstat(f.fileno()).st_size < INDEX_RECORD.size:
+				return None
+			with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as index:
+				count = len(index) // INDEX_RECORD.size
+				if not is_sorted:
+					for entry_slot, offset in INDEX_RECORD.iter_unpack(index[:count * INDEX_RECORD.size]):
+						if entry_slot == slot:
+							return offset
+					return None
+
+				low, high = 0, count
+				while low < high:
+					middle = (low + high) // 2
+					if INDEX_RECORD.unpack_from(index, middle * INDEX_RECORD.size)[0] < slot:
+						low = middle + 1
+					else:
+						high = middle
+				if low < count:
+					entry_slot, offset = INDEX_RECORD.unpack_from(index, low * INDEX_RECORD.size)
+					if entry_slot == slot:
+						return offset
+				return None
+
+	# Read the entry for slot from its segment (None if it was never committed or its segment was deleted).
+	# Only the segments whose highest slot is at least slot are searched, without holding the writer's lock
+	def read_entry(self, slot):
+		with self.lock:
+			segments = sorted([segment for segment, last_slot in self.segments.items() if last_slot >= slot])
+			sorted_indexes = set(self.sorted_indexes)
+
+		for segment in segments:
+			offset = self.search_index(segment, slot, segment in sorted_indexes)
+			if offset is None:
+				continue
+			try:
+				f = open(self.filenames["SEGMENT"].format(segment), 'rb')
+			except OSError:
+				return None
+			with f:
+				f.seek(offset)
+				slot, event = pickle.load(f)
+			return event
+		return None
+
+	# Return the numbers of the log segments on disk, oldest first (segments covered by the snapshot may be gone)
+	def list_segments(self):
+		prefix = "server_{}_log.".format(self.ID)
+		segments = []
+		for filename in os.listdir("."):
+			number = filename[len(prefix):-len(".log")]
+			if filename.startswith(prefix) and filename.endswith(".log") and number.isdigit():
+				segments.append(int(number))
+		return sorted(segments)
+
+	# Replay a given list of (slot, event)
 	def replay(self, events):
-		print("[LOG] Replaying {} events...".format(len(events)))
+		self.tracer.info("REPLAYING", EVENTS = len(events))
 		for i in range(len(events)):
-			print("[LOG] {} - {}".format(i + 1, str(events[i])))
-			self.process_event_internally(events[i])
-		print("[LOG] Finished replaying events")
+			slot, event = events[i]
+			if trace_module.DEBUG_ENABLED:
+				self.tracer.debug("REPLAYING", SLOT = slot + 1, EVENT = event)
+			self.process_event_internally(event, slot)
+		self.tracer.info("FINISHED REPLAYING")
 
-	# Write an event to disk
+	# Queue an event (and its index record) for the writer thread, return its sequence number
 	def write(self, slot, event):
-		with self.lock:
-			# Write to file
-			# open the file of current server for write in append mode
-			f = open(self.filenames["LOG"], 'ab')
-			# write in (slot, event_obj)
-			pickle.dump((slot,event), f)
+		with self.write_condition:
+			# Start a new segment once the current one is full
+			if self.segment_records >= SEGMENT_SIZE:
+				self.segment += 1
+				self.segment_records = 0
+				self.segment_bytes = 0
+
+			# (slot, event_obj) at the end of the current segment
+			data = pickle.dumps((slot,event))
+			self.pending.append((self.segment, data, INDEX_RECORD.pack(slot, self.segment_bytes)))
+			self.appended += 1
+			self.write_condition.notify_all()
+
+			self.segments[self.segment] = max(self.segments.get(self.segment, -1), slot)
+			self.segment_records += 1
+			self.segment_bytes += len(data)
+			return self.appended
+
+	# Return a Future resolved once every record up to seq is fsynced, whatever the durability policy
+	def durable_future(self, seq):
+		future = concurrent.futures.Future()
+		with self.write_condition:
+			if seq <= self.durable:
+				future.set_result(seq)
+			else:
+				self.sync_requested = True
+				self.write_condition.notify_all()
+				self.waiter_count += 1
+				heapq.heappush(self.waiters, (seq, self.waiter_count, future))
+		return future
+
+	# Block until every record up to seq is fsynced
+	def wait_durable(self, seq):
+		self.durable_future(seq).result()
+
+	# Log writer thread: write every queued record at once, then fsync according to the durability policy
+	def writer(self):
+		segment, data_file, index_file = None, None, None
+		last_sync = time.time()
+		while True:
+			with self.write_condition:
+				while (len(self.pending) == 0) and (not self.sync_requested):
+					# Written but not yet fsynced records are synced once the interval is over
+					if (self.durability == "INTERVAL") and (self.written > self.durable):
+						remaining = last_sync + self.durability_interval - time.time()
+						if remaining <= 0:
+							break
+						self.write_condition.wait(remaining)
+					else:
+						self.write_condition.wait()
+
+				batch, self.pending = self.pending, []
+				seq = self.appended
+				sync = self.sync_requested or (self.durability == "COMMIT") or \
+				((self.durability == "INTERVAL") and (time.time() - last_sync >= self.durability_interval))
+				self.sync_requested = False
+
+			for record_segment, data, index in batch:
+				# Close the full segment and open the next one
+				if record_segment != segment:
+					if data_file is not None:
+						self.close_segment_files(data_file, index_file)
+						self.sort_index(segment)
+					segment = record_segment
+					data_file = open(self.filenames["SEGMENT"].format(segment), 'ab')
+					index_file = open(self.filenames["INDEX"].format(segment), 'ab')
+				data_file.write(data)
+				index_file.write(index)
+
+			if data_file is not None:
+				data_file.flush()
+				index_file.flush()
+				if sync:
+					os.fsync(data_file.fileno())
+					os.fsync(index_file.fileno())
+					last_sync = time.time()
+
+			with self.write_condition:
+				self.written = seq
+				if sync or (data_file is None):
+					self.durable = seq
+					while (len(self.waiters) > 0) and (self.waiters[0][0] <= self.durable):
+						heapq.heappop(self.waiters)[2].set_result(self.durable)
+
+	# Close a segment the writer moved past, syncing it first unless the operating system handles write back
+	def close_segment_files(self, data_file, index_file):
+		for f in [data_file, index_file]:
+			f.flush()
+			if self.durability != "OS":
+				os.fsync(f.fileno())
 			f.close()
 
-	# Return the in-memory log
+	# Return the log, loading every entry not in memory yet
 	def get_log(self):
+		for slot in range(self.next_available_slot):
+			self.get_entry(slot)
 		return self.events_log
 
-	# Store the timeline to disk
-	def store_timeline(self):
-		with self.lock:
-			pickle.dump(self.timeline, open(self.filenames["TIMELINE"], "wb" ))
+	# Thread that takes a snapshot every snapshot_interval commits, or every snapshot_freq seconds
+	def snapshotter(self):
+		while True:
+			self.snapshot_requested.wait(self.snapshot_freq)
+			self.snapshot_requested.clear()
+			if self.commits_since_snapshot > 0:
+				self.take_snapshot()
+
+	# Write the tweets, blocklist and slot bookkeeping to disk, then delete log segments it covers. The timeline
+	# is rebuilt from them on recovery
+	def take_snapshot(self):
+		# Copy the state under the lock, the slow pickling and fsync happen outside of it
+		with self.state_lock:
+			snapshot = self.get_state()
+			snapshot["SEGMENTS"] = dict(self.segments)
+			snapshot["POSITION"] = (self.segment, self.segment_bytes)
+			self.commits_since_snapshot = 0
+			seq = self.appended
+
+		# The log must hold every record the snapshot covers before the snapshot replaces it
+		self.wait_durable(seq)
+
+		# Write next to the old snapshot, then atomically swap it in
+		temp_filename = self.filenames["SNAPSHOT"] + ".tmp"
+		f = open(temp_filename, "wb")
+		pickle.dump(snapshot, f)
+		f.flush()
+		os.fsync(f.fileno())
+		f.close()
+		os.replace(temp_filename, self.filenames["SNAPSHOT"])
+		self.snapshot_slot = snapshot["CONTIGUOUS_PREFIX"]
+		self.tracer.info("SNAPSHOT TAKEN", SLOT = self.snapshot_slot)
+
+		self.truncate_segments()
+
+	# Return a copy of the state every server shares (tweets, blocklist and which slots it reflects). The
+	# timeline is left out, it depends on the user. Each author's tweet dict is shared with the copy instead of
+	# copied and is only copied before its next change, so this is O(authors) rather than O(tweets)
+	def get_state(self):
+		with self.state_lock:
+			self.shared_authors = set(self.tweets_by_author)
+			return {\
+			"TWEETS_BY_AUTHOR" : dict(self.tweets_by_author), \
+			"BLOCKS" : set(self.blocks), \
+			"FORWARD_KEYS" : list(self.forward_keys), \
+			"CONTIGUOUS_PREFIX" : self.contiguous_prefix, \
+			"NEXT_AVAILABLE_SLOT" : self.next_available_slot, \
+			"HOLES" : set(self.holes)}
+
+	# Replace our state with a peer's (from get_state) when it is further ahead, keeping the entries we
+	# committed that it does not reflect. Return True if it was installed
+	def install_state(self, state):
+		with self.state_lock:
+			if state["CONTIGUOUS_PREFIX"] <= self.contiguous_prefix:
+				return False
+			self.tracer.info("INSTALLING STATE", SLOT = state["CONTIGUOUS_PREFIX"])
+
+			# Our entries in the peer's holes or past its high-water mark
+			slots = [slot for slot in state["HOLES"] if self.is_filled(slot)]
+			slots += [slot for slot in range(state["NEXT_AVAILABLE_SLOT"], self.next_available_slot) if self.is_filled(slot)]
+			events = [(slot, self.get_entry(slot)) for slot in sorted(slots)]
 
-	# Store the blocklist to disk
-	def store_blocklist(self):
+			self.tweets_by_author = state["TWEETS_BY_AUTHOR"]
+			self.shared_authors = set()
+			self.blocks = state["BLOCKS"]
+			self.forward_keys = dict.fromkeys(state.get("FORWARD_KEYS", []))
+			self.rebuild_timeline()
+			self.contiguous_prefix = state["CONTIGUOUS_PREFIX"]
+			self.next_available_slot = state["NEXT_AVAILABLE_SLOT"]
+			self.holes = set(state["HOLES"])
+			while len(self.events_log) < self.next_available_slot:
+				self.extend_events_log()
+
+			for slot, event in events:
+				self.track_slot(slot)
+				self.process_event_internally(event, slot)
+
+			# Nothing in our log covers the installed slots, persist them with a snapshot
+			self.commits_since_snapshot += 1
+			self.snapshot_requested.set()
+			return True
+
+	# Rebuild the timeline from every committed tweet and the blocklist
+	def rebuild_timeline(self):
+		self.timeline = dict()
+		for author, tweets in self.tweets_by_author.items():
+			if InsertBlock(author, self.username) not in self.blocks:
+				self.timeline.update(tweets)
+		self.timeline_keys = sorted(self.timeline)
+
+	# Delete log segments whose slots are all covered by the snapshot, keeping the newest SEGMENTS_RETAINED
+	def truncate_segments(self):
 		with self.lock:
-			pickle.dump(self.blocks, open(self.filenames["BLOCKLIST"], "wb" ))
+			covered = sorted([segment for segment in self.segments if (segment != self.segment) and (self.segments[segment] < self.snapshot_slot)])
+			for segment in covered[:max(len(covered) - SEGMENTS_RETAINED, 0)]:
+				os.remove(self.filenames["SEGMENT"].format(segment))
+				if os.path.isfile(self.filenames["INDEX"].format(segment)):
+					os.remove(self.filenames["INDEX"].format(segment))
+				del self.segments[segment]
+				self.sorted_indexes.discard(segment)
 
 	# Return the entry for a given slot
 	def get_entry(self, slot):
 		# Return None if the slot is outside of log bounds (even definitely not present)
 		if slot >= len(self.events_log):
 			return None
-		return self.events_log[slot]
-
-	# Set an entry for a given slot if it is not already filled
-	def set_entry(self, slot, event):
-		# Do not write to the log if it is already present
-		if self.get_entry(slot) is not None:
-			return
-
-		print("[LOG] Adding entry -> {}".format(str(event)))
-
-		# Add event to in-memory data structure
-		while len(self.events_log) - 1 < slot:
-			self.extend_events_log()
-		self.events_log[slot] = event
-
-		# Add event to disk
-		self.write(slot, event)
-
-		# Add event to in-memory data structure
-		self.process_event_internally(event)
-
-		# Increment and potentially store checkpoints
-		self.increment_checkpoint()
-		if self.checkpoint % 5 == 0:
-			self.store_timeline()
-			self.store_blocklist()
-
-
-	# Save event to any relevant in-memory data structures it corresponds to
-	def process_event_internally(self, event):
+		event = self.events_log[slot]
+
+		# Committed entries not read since boot are loaded from their segment
+		if (event is None) and self.is_filled(slot):
+			event = self.read_entry(slot)
+			self.events_log[slot] = event
+		return event
+
+	# Set an entry for a given slot if it is not already filled. Return the entry's write sequence number
+	# (None if it was already filled), once it is fsynced under the "COMMIT" policy unless wait is False
+	def set_entry(self, slot, event, wait = True):
+		# Hold the state lock so a slot (and every event of a batch) is applied exactly once
+		with self.state_lock:
+			# Do not write to the log if it is already present (slots below the prefix may only be in the snapshot)
+			if (slot < self.contiguous_prefix) or (self.get_entry(slot) is not None):
+				return None
+
+			if trace_module.DEBUG_ENABLED:
+				self.tracer.debug("ADDING ENTRY", SLOT = slot + 1, EVENT = event)
+
+			# Add event to in-memory data structure
+			while len(self.events_log) - 1 < slot:
+				self.extend_events_log()
+			self.events_log[slot] = event
+			self.track_slot(slot)
+
+			# Queue event for the log writer
+			seq = self.write(slot, event)
+
+			# Add event to in-memory data structure
+			self.process_event_internally(event, slot)
+
+			# Request a snapshot once enough events were committed since the last one
+			self.commits_since_snapshot += 1
+			if self.commits_since_snapshot >= self.snapshot_interval:
+				self.snapshot_requested.set()
+
+		# Wait outside of the state lock so commits arriving meanwhile share the fsync
+		if (self.durability == "COMMIT") and wait:
+			self.wait_durable(seq)
+		return seq
+
+
+	# Save event to any relevant in-memory data structures it corresponds to. index is the position of
+	# the event inside a batch
+	def process_event_internally(self, event, slot, index = 0):
 		# Event Type Procedure:
-		# Tweet       -> Add to Timeline
-		# InsertBlock -> Add to block list
-		# DeleteBlock -> Remove from block list
-		if type(event) == Tweet and self.is_viewable(event):
-			self.timeline.append(event)
-		elif type(event) == InsertBlock:
-			self.blocks.add(event)
-			self.rebuild_timeline()
-		elif type(event) == DeleteBlock:
-			self.blocks -= set([event.convert_to_IB()])
-			self.rebuild_timeline()
-
-	# Rebuild the timeline based on the current contents of the log and blocklist
-	def rebuild_timeline(self):
-		self.timeline = []
-		for event in self.events_log:
-			if type(event) == Tweet and self.is_viewable(event):
-				self.timeline.append(event)
+		# Tweet       -> Add to Timeline (if viewable) and to its author's tweets
+		# InsertBlock -> Add to block list, hide the blocker's tweets if we are the blockee
+		# DeleteBlock -> Remove from block list, reveal the blocker's tweets if we are the blockee
+		# Batch       -> Apply every contained event, in order, before anyone can view the result
+		# Forwarded   -> Apply the forwarded event unless its key was already applied
+		# NoOp        -> Nothing to apply
+		with self.state_lock:
+			if type(event) == Batch:
+				batched_events = event.unpack()
+				for i in range(len(batched_events)):
+					self.process_event_internally(batched_events[i], slot, i)
+			elif type(event) == Forwarded:
+				if event.key in self.forward_keys:
+					return
+				self.forward_keys[event.key] = None
+				if len(self.forward_keys) > FORWARD_KEYS_RETAINED:
+					del self.forward_keys[next(iter(self.forward_keys))]
+				self.process_event_internally(event.unpack(), slot, index)
+			elif type(event) == Tweet:
+				key = (event.get_timestamp(), slot, index)
+				if event.username not in self.tweets_by_author:
+					self.tweets_by_author[event.username] = dict()
+				elif event.username in self.shared_authors:
+					self.tweets_by_author[event.username] = dict(self.tweets_by_author[event.username])
+					self.shared_authors.discard(event.username)
+				self.tweets_by_author[event.username][key] = event
+				if self.is_viewable(event):
+					self.add_to_timeline(key, event)
+			elif type(event) == InsertBlock:
+				self.blocks.add(event)
+				if event.follower == self.username:
+					self.hide_tweets(event.username)
+			elif type(event) == DeleteBlock:
+				self.blocks.discard(event.convert_to_IB())
+				if event.follower == self.username:
+					self.reveal_tweets(event.username)
+
+	# Remove every tweet by username from the timeline, filtering the sorted keys once (O(timeline)) rather
+	# than deleting each key from the list
+	def hide_tweets(self, username):
+		hidden = [key for key in self.tweets_by_author.get(username, ()) if key in self.timeline]
+		if len(hidden) == 0:
+			return
+		for key in hidden:
+			del self.timeline[key]
+		self.timeline_keys = [key for key in self.timeline_keys if key in self.timeline]
+
+	# Add every tweet by username back to the timeline, merging its sorted keys into the timeline's at once
+	def reveal_tweets(self, username):
+		revealed = [key for key in self.tweets_by_author.get(username, dict()) if key not in self.timeline]
+		if len(revealed) == 0:
+			return
+		tweets = self.tweets_by_author[username]
+		for key in revealed:
+			self.timeline[key] = tweets[key]
+		self.timeline_keys = list(heapq.merge(self.timeline_keys, sorted(revealed)))
+
+	# Insert a tweet into the timeline, keeping its keys sorted (binary search for the position)
+	def add_to_timeline(self, key, tweet):
+		if key in self.timeline:
+			return
+		self.timeline[key] = tweet
+		bisect.insort(self.timeline_keys, key)
 
 	# Extend the events log to twice its size
 	def extend_events_log(self):
@@ -160,70 +650,99 @@ class Log():
 			size = len(self.events_log)
 			self.events_log.extend([None] * size)
 
+	# Update the high-water mark, contiguous prefix and holes for a newly filled slot
+	def track_slot(self, slot):
+		if slot >= self.next_available_slot:
+			if slot > self.next_available_slot:
+				self.holes.update(range(self.next_available_slot, slot))
+				self.holes_detected.set()
+			self.next_available_slot = slot + 1
+		else:
+			self.holes.discard(slot)
+
+		# Every slot between the prefix and the high-water mark is either filled or a hole
+		while (self.contiguous_prefix < self.next_available_slot) and (self.contiguous_prefix not in self.holes):
+			self.contiguous_prefix += 1
+
 	# Return the next available slot (slot after last filled entry)
 	def get_next_available_slot(self):
-		for i in range(len(self.events_log) - 1, -1, -1):
-			if self.events_log[i] is not None:
-				return i + 1
-		return 0
+		return self.next_available_slot
+
+	# Return the first empty slot: every slot below it is committed on this server
+	def get_contiguous_prefix(self):
+		return self.contiguous_prefix
+
+	# Return the first slot not covered by the latest snapshot: every slot below it is durable on this server
+	def get_snapshot_slot(self):
+		return self.snapshot_slot
+
+	# Return True if slot is committed on this server (its entry may only be in the snapshot)
+	def is_filled(self, slot):
+		return (slot < self.next_available_slot) and (slot not in self.holes)
+
+	# Return the number of committed slots in [start, end)
+	def count_filled(self, start, end):
+		with self.state_lock:
+			end = min(end, self.next_available_slot)
+			if end <= start:
+				return 0
+			return end - start - len([slot for slot in self.holes if start <= slot < end])
+
+	# Return the sorted list of empty slots below the next available slot
+	def get_holes(self):
+		with self.state_lock:
+			return sorted(self.holes)
 
 	# Determine if an event is viewable for this person
 	def is_viewable(self, event):
 		# All users can see non-tweet events
 		if type(event) != Tweet:
 			return True
-			
-		# Check all the blocks and see if there are any which would prevent us from viewing the event
-		for block in self.blocks:
-			# If the event username matches an InsertBlock initiator, is our user the blockee?
-			if (event.username == block.username) and (block.follower == self.username):
-				return False
-		return True
 
-	# Display the timeline
-	def view_timeline(self):
+		# Hidden if the author blocked our user
+		return InsertBlock(event.username, self.username) not in self.blocks
+
+	# Return up to count (key, tweet) pairs, newest first, older than the key before (None for the latest)
+	def get_timeline(self, count = TIMELINE_PAGE_SIZE, before = None):
+		with self.state_lock:
+			if before is None:
+				end = len(self.timeline_keys)
+			else:
+				end = bisect.bisect_left(self.timeline_keys, before)
+			keys = self.timeline_keys[max(end - count, 0):end]
+			return [(key, self.timeline[key]) for key in reversed(keys)]
+
+	# Display a page of the timeline, starting from the latest tweet or (more) where the last page ended
+	def view_timeline(self, count = TIMELINE_PAGE_SIZE, more = False):
+		if not more:
+			self.timeline_cursor = None
+		page = self.get_timeline(count, self.timeline_cursor)
+		if len(page) > 0:
+			self.timeline_cursor = page[-1][0]
+
 		output = "{:-^120}\n".format("TIMELINE")
-		for event in sorted(self.timeline, reverse = True):
+		for key, event in page:
 			output += str(event) + "\n"
+		if len(page) == count:
+			output += "(more)\n"
 		output += "-" * 120
 		print(output)
 
 	# Display the contents of the log
 	def view_log(self):
 		output = "{:-^120}\n".format("LOG CONTENTS")
-		for i in range(len(self.events_log)):
-			output += "SLOT {}: {}\n".format(i + 1, str(self.events_log[i]))
+		events_log = self.get_log()
+		for i in range(len(events_log)):
+			output += "SLOT {}: {}\n".format(i + 1, str(events_log[i]))
 		output += "-" * 120
 		print(output)
 
 	# Display the blocklist
 	def view_blocklist(self):
 		output = "{:-^120}\n".format("BLOCK LIST")
-		for block in self.blocks:
+		with self.state_lock:
+			blocks = list(self.blocks)
+		for block in blocks:
 			output += str(block) + "\n"
 		output += "-" * 120
 		print(output)
-
-	# Increment the checkpoint
-	def increment_checkpoint(self):
-		self.checkpoint += 1
-
-	# Return the leader for a given slot
-	def is_leader(self, slot, ID):
-		# Look in previous slot
-		slot = slot - 1
-		if slot < 0:
-			return 0
-
-		event = self.get_entry(slot)
-		if event is None:
-			return 0
-
-		return ID == self.get_ID_from_username(event.username)
-
-	# Lookup a username and find the corresponding server ID
-	def get_ID_from_username(self, username):
-		for ID in self.server_config:
-			if self.server_config[ID]["USERNAME"].title() == username.title():
-				return ID
-		return 0
@@ -1,7 +1,14 @@
-import socket
 import _thread
+import threading
+import collections
+import queue
+import concurrent.futures
+import asyncio
 import os, sys
-import pickle
+import random
+import wire_module
+import trace_module
+import transport_module
 from event_module import *
 import time
 
@@ -11,17 +18,221 @@ ARRAY_INIT_SIZE = 8
 # Max amount of time allowed for expected incoming messages
 TIMEOUT = 1
 
+# Phases wait for responses as long as the acceptors' measured round-trip times warrant: each acceptor's timeout
+# is its smoothed RTT plus RTT_K times its RTT variance (as TCP computes them, RFC 6298), between MIN_TIMEOUT
+# and TIMEOUT, and doubled after every phase it did not answer in time
+RTT_ALPHA = 0.125
+RTT_BETA = 0.25
+RTT_K = 4
+MIN_TIMEOUT = 0.05
+
 # Time between each garbage collection procedure on the message buffer (remove expired messages)
 GARBAGE_COLLECT_FREQ = TIMEOUT * 3
 
+# Hole filling: holes are looked for as soon as a commit arrives out of order (and every HOLE_CHECK_FREQ
+# seconds), after HOLE_GRACE seconds for commits still in flight. Holes less than HOLE_RANGE_GAP slots apart
+# are requested together and at most HOLE_FILL_PARALLELISM ranges are filled at once
+HOLE_CHECK_FREQ = 60
+HOLE_GRACE = 0.1
+HOLE_RANGE_GAP = 16
+HOLE_FILL_PARALLELISM = 4
+
+# Time between reports of this server's snapshot slot to the acceptors (lets them discard old slots)
+WATERMARK_FREQ = 30
+
+# Maximum number of slots this proposer keeps in flight concurrently
+PIPELINE_WINDOW = 8
+
+# A pipelined event that failed to commit is proposed again after a random delay of up to
+# RETRY_BASE_DELAY * 2^(failed attempts) seconds (at most RETRY_MAX_DELAY), so competing proposers do not
+# retry in lockstep
+RETRY_BASE_DELAY = 0.01
+RETRY_MAX_DELAY = 2
+
+# Batching: accumulate pending events for up to BATCH_MAX_DELAY seconds, BATCH_MAX_EVENTS events or
+# BATCH_MAX_BYTES encoded bytes (keeps the datagram under the receive buffer size) and commit them in one slot
+BATCHING = False
+BATCH_MAX_DELAY = 0.005
+BATCH_MAX_EVENTS = 16
+BATCH_MAX_BYTES = 3072
+
+# Multi-Paxos: once elected, a leader runs a single PREPARE covering every later slot and then only ACCEPTs
+MULTI_PAXOS = True
+
+# Leader election: every proposer sends a HEARTBEAT to all proposers every HEARTBEAT_FREQ seconds and takes the
+# lowest server ID heard from in the last LEASE_TIMEOUT seconds as the leader. Events submitted to any other
+# server are forwarded to the leader's proposer, so only the leader issues ballots
+FORWARDING = True
+HEARTBEAT_FREQ = 0.1
+LEASE_TIMEOUT = 0.5
+
+# A forwarded event without a result after FORWARD_TIMEOUT seconds has failed (and is retried if requested).
+# One whose leader lost the lease is forwarded to the new leader as well, the log applies it only once
+FORWARD_TIMEOUT = 5
+
+# Results the leader remembers for committed forwarded events, re-sent when a forward is retried
+FORWARD_RESULTS_MAX = 4096
+
+# Messages shed first when the worker queue is full: a lost promise only delays a proposal, a lost ACK stalls
+# a slot already accepted
+SHED_ORDER = ("PROMISE", "PROMISE_ALL")
+
+# Wakes a phase waiting on responses for one (type, slot, ballot) the moment a new response arrives. The
+# phase gives up as soon as more than rejection_limit acceptors rejected it (a majority is out of reach)
+class QuorumTracker():
+	def __init__(self, key, majority_size, rejection_limit = None):
+		self.key = key
+		self.majority_size = majority_size
+		self.rejection_limit = rejection_limit
+		self.rejections = 0
+		self.condition = threading.Condition()
+
+	# Wake the waiting phase so it can recount its responses
+	def signal(self):
+		with self.condition:
+			self.condition.notify_all()
+
+	# Count an acceptor's rejection, waking the phase if a majority can no longer be reached
+	def reject(self):
+		with self.condition:
+			self.rejections += 1
+			self.condition.notify_all()
+
+	# Return True once more acceptors rejected the phase than it can afford
+	def aborted(self):
+		return (self.rejection_limit is not None) and (self.rejections > self.rejection_limit)
+
+	# Block until count() reaches a majority, the phase is aborted or the timeout expires
+	def wait(self, count, timeout):
+		deadline = time.time() + timeout
+		with self.condition:
+			while (count() < self.majority_size) and (not self.aborted()):
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					break
+				self.condition.wait(remaining)
+
+
+# Round-trip time estimate of every acceptor, sampled from the delay between sending a phase's messages and
+# each acceptor's response to them
+class RTTEstimator():
+	def __init__(self, majority_size):
+		self.majority_size = majority_size
+		self.lock = _thread.allocate_lock()
+		self.srtt = dict()
+		self.rttvar = dict()
+		self.backoff = dict()
+
+		# Phase key (response type, slot, ballot) -> time its messages were sent, in sending order. Kept for
+		# TIMEOUT seconds so responses arriving after the phase gave up are measured too
+		self.started = dict()
+
+	# Record that the messages of the phase awaiting responses keyed by key are being sent
+	def start(self, key):
+		with self.lock:
+			self.started.pop(key, None)
+			self.started[key] = time.time()
+
+	# Update acceptor ID's estimate with its response keyed by key received at timestamp
+	def sample(self, key, ID, timestamp):
+		with self.lock:
+			started = self.started.get(key)
+			if started is None:
+				return
+			rtt = timestamp - started
+			if ID not in self.srtt:
+				self.srtt[ID] = rtt
+				self.rttvar[ID] = rtt / 2
+			else:
+				self.rttvar[ID] = (1 - RTT_BETA) * self.rttvar[ID] + RTT_BETA * abs(self.srtt[ID] - rtt)
+				self.srtt[ID] = (1 - RTT_ALPHA) * self.srtt[ID] + RTT_ALPHA * rtt
+			self.backoff[ID] = 1
+
+	# Double the timeout of acceptors that did not respond in time
+	def back_off(self, IDs):
+		with self.lock:
+			for ID in IDs:
+				self.backoff[ID] = min(self.backoff.get(ID, 1) * 2, TIMEOUT / MIN_TIMEOUT)
+
+	# Return acceptor ID's timeout, TIMEOUT until it has been measured (caller holds the lock)
+	def timeout(self, ID):
+		if ID not in self.srtt:
+			return TIMEOUT
+		rto = max(self.srtt[ID] + RTT_K * self.rttvar[ID], MIN_TIMEOUT) * self.backoff[ID]
+		return min(rto, TIMEOUT)
+
+	# Return how long a phase waits for a majority of the acceptors IDs: the majority-th shortest timeout
+	def quorum_timeout(self, IDs):
+		with self.lock:
+			timeouts = sorted([self.timeout(ID) for ID in IDs])
+		return timeouts[min(self.majority_size, len(timeouts)) - 1]
+
+	# Forget phases started more than TIMEOUT seconds ago
+	def expire(self, current_time):
+		with self.lock:
+			expired = []
+			for key, started in self.started.items():
+				if current_time - started <= TIMEOUT:
+					break
+				expired.append(key)
+			for key in expired:
+				del self.started[key]
+
+
+# Received messages indexed by (TYPE, SLOT, N) with a time-ordered queue of arrivals for expiry
+class MessageBuffer():
+	def __init__(self, expiry):
+		self.expiry = expiry
+		self.lock = _thread.allocate_lock()
+		self.messages = dict()
+		self.arrivals = collections.deque()
+
+	# Add a message received at timestamp
+	def add(self, msg, timestamp):
+		key = (msg["TYPE"], msg.get("SLOT"), msg.get("N"))
+		with self.lock:
+			if key not in self.messages:
+				self.messages[key] = collections.deque()
+			self.messages[key].append(msg)
+			self.arrivals.append((timestamp, key))
+		return key
+
+	# Return all buffered messages for a (TYPE, SLOT, N) key
+	def get(self, key):
+		with self.lock:
+			return list(self.messages.get(key, ()))
+
+	# Return the number of buffered messages for a (TYPE, SLOT, N) key
+	def count(self, key):
+		with self.lock:
+			return len(self.messages.get(key, ()))
+
+	# Remove messages older than the expiry time, oldest first
+	def expire(self, current_time):
+		with self.lock:
+			while (len(self.arrivals) > 0) and (current_time - self.arrivals[0][0] > self.expiry):
+				timestamp, key = self.arrivals.popleft()
+				messages = self.messages[key]
+				messages.popleft()
+				if len(messages) == 0:
+					del self.messages[key]
+
+
+# Future of an event forwarded to us by another server, a failure is reported back (the forwarder retries it)
+class ForwardedFuture(concurrent.futures.Future):
+	pass
+
 # Proposer Class
-class Proposer():
-	def __init__(self, ID, server_config, log, local_run = False):
+class Proposer(transport_module.Role):
+	def __init__(self, ID, server_config, log, local_run = False, pipeline_window = PIPELINE_WINDOW, batching = BATCHING, runtime = None, transport = None):
 		self.ID = ID
 		self.log = log
 		self.server_config = server_config
 		self.local_run = local_run
 
+		# Messaging shared by every role: transport, tracer, sending and dropping messages
+		transport_module.Role.__init__(self, "PROPOSER", ID, server_config, local_run, transport)
+
 		# IP/Port Configuration for this Proposer
 		if local_run:
 			self.IP = ''
@@ -34,23 +245,62 @@ class Proposer():
 		# Array of event counts for each slot (n)
 		self.event_counter = [0] * ARRAY_INIT_SIZE
 
+		# Multi-Paxos leadership: ballot promised to us for every slot from our election on (None when not leader)
+		self.leader_ballot = None
+		self.leader_round = 0
+
+		# Next slot this proposer will use, kept locally so concurrent proposals never share a slot
+		self.next_slot = 0
+
+		# Slots whose proposal gave up without knowing what was chosen, decided by a later proposal
+		self.abandoned_slots = set()
+
+		# Only one election may run at a time, pipelined insertions wait for its outcome
+		self.election_lock = _thread.allocate_lock()
+
+		# Last time a heartbeat was heard from each server's proposer (everyone counts as alive at startup)
+		self.last_heard = dict([(server, time.time()) for server in server_config])
+
+		# Events forwarded to the leader awaiting its result: sequence number -> (item, time forwarded, leader).
+		# An event keeps its sequence number, part of the key of the Forwarded value committed, across retries:
+		# future -> sequence number. Sequence numbers restart at every boot, the start time (incarnation) keeps
+		# the keys of this run apart from those of earlier runs
+		self.incarnation = time.time_ns()
+		self.forward_seq = 0
+		self.forwarded = dict()
+		self.forward_seqs = dict()
+
+		# Forwarded events, by key, being proposed and committed (with their result)
+		self.forwards_in_progress = set()
+		self.forward_results = collections.OrderedDict()
+
+		# Queue of (event, future, retry, failed attempts) submitted to the pipeline
+		self.pipeline_queue = queue.Queue()
+
+		# Queue of (event, future, retry, failed attempts) waiting to be grouped into a batch
+		self.batching = batching
+		self.batch_queue = queue.Queue()
+
 		# Majority Size
 		self.majority_size = (len(server_config.keys()) // 2) + 1
 
 		# Message Buffer
-		self.message_buffer = []
+		self.message_buffer = MessageBuffer(TIMEOUT)
 
-		# Number of messages for the listening thread to drop (used for debug purposes)
-		self.drop_counter = 0
+		# Round-trip times of the acceptors, setting how long each phase waits for a majority
+		self.rtt = RTTEstimator(self.majority_size)
 
-		# Persistent Sending Socket
-		self.send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # UDP
+		# Quorum trackers for in-flight phases keyed by (response type, slot, ballot)
+		self.quorum_trackers = dict()
 
 		# Lock for reading/writing to arrays
 		self.lock = _thread.allocate_lock()
 
-		# Start listening thread for incoming messages
-		_thread.start_new_thread(self.listen, ())
+		# Worker threads filling hole ranges concurrently
+		self.hole_executor = concurrent.futures.ThreadPoolExecutor(max_workers = HOLE_FILL_PARALLELISM)
+
+		# Serve incoming messages on the node runtime's event loop if given, otherwise on a worker pool
+		self.serve(self.port, runtime, SHED_ORDER)
 
 		# Start garbage collection thread for message buffer
 		_thread.start_new_thread(self.message_buffer_garbage_collector, ())
@@ -58,99 +308,457 @@ class Proposer():
 		# Start the hole filling thread that checks for log holes
 		_thread.start_new_thread(self.hole_filler, ())
 
-	# Listen for incoming connections by binding to the socket specified in the hosts file
-	def listen(self):
-		try:
-			self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # UDP
-			self.sock.bind(('', self.port))
-			while True:
-				msg, source = self.sock.recvfrom(4096)
-
-				# Drop messages if requested to by the user
-				if self.drop_counter > 0:
-					self.drop_counter -= 1
-					continue
+		# Start the thread reporting our snapshot slot to the acceptors
+		_thread.start_new_thread(self.watermark_reporter, ())
 
-				# Process message on a thread
-				_thread.start_new_thread(self.process_message, (msg, source,))
+		# Start the heartbeat thread electing the leader
+		_thread.start_new_thread(self.heartbeat, ())
 
-		except:
-			# Restart listening thread
-			_thread.start_new_thread(self.listen, ())
+		# Start one pipeline worker per slot allowed in flight
+		for i in range(pipeline_window):
+			_thread.start_new_thread(self.pipeline_worker, ())
 
+		# Start the batching thread that groups submitted events into batches
+		if batching:
+			_thread.start_new_thread(self.batcher, ())
 
 	# Process the received message
 	def process_message(self, msg, source):
-		msg = pickle.loads(msg)
+		msg = self.decode(msg, source)
+		if msg is None:
+			return
+		msg_type = msg["TYPE"]
+
+		# Leader election and forwarded events are handled at once, no phase waits on them
+		if msg_type == "HEARTBEAT":
+			if msg["ID"] in self.last_heard:
+				self.last_heard[msg["ID"]] = time.time()
+			return
+		elif msg_type == "FORWARD":
+			self.receive_forward(msg)
+			return
+		elif msg_type == "FORWARD_RESULT":
+			self.receive_forward_result(msg)
+			return
 
 		# received timestamp in order to remove expired messages later on
 		recv_timestamp = time.time()
 
 		# Add message to the buffer
-		self.message_buffer.append((recv_timestamp, msg))
+		key = self.message_buffer.add(msg, recv_timestamp)
+
+		# A response to one of our phases measures the round-trip time to the acceptor that sent it
+		if "ID" in msg:
+			self.rtt.sample(key, msg["ID"], recv_timestamp)
+
+		# Wake the phase waiting on this response, if any
+		tracker = self.quorum_trackers.get(key)
+		if tracker is not None:
+			tracker.signal()
+
+		# An acceptor rejected our ballot: make our next ballots higher than the one it promised, and give up
+		# on the phase as soon as a majority is out of reach
+		if msg_type == "NACK":
+			self.observe_ballot(msg["SLOT"], msg["MAX_PREPARE"])
+			for phase in ["PROMISE", "ACK", "PROMISE_ALL"]:
+				tracker = self.quorum_trackers.get((phase, msg["SLOT"], msg["N"]))
+				if tracker is not None:
+					tracker.reject()
+
+	# Return True/False if the event was successfully inserted into the latest available slot. With retry the
+	# event is proposed until it commits, see settle_slot
+	def insert_event(self, event, retry = False):
+		if MULTI_PAXOS:
+			return self.insert_event_as_leader(event, retry)
+
+		# Reserve the next available slot, and a new one whenever another value is chosen in it
+		while True:
+			slot = self.allocate_slot()
+			if self.settle_slot(slot, event, retry):
+				return True
+			if not retry:
+				return False
 
-		# Display Debug Information
-		msg_type = msg["TYPE"]
-		s1 = "Server: [{}   {}]".format(self.ID, "PROPOSER")
-		s2 = "Status: [{} {}]".format("RECEIVED", msg_type)
-		s3 = "Source:      [{}:{}]".format(source[0], source[1])
-		print("{:<40} {:<40} {:<40}".format(s1, s2, s3))
+	# Decide a slot event was proposed in. A failed attempt keeps the event in its slot, so it is never chosen in
+	# two slots: with retry the slot is proposed again after a backoff until a majority answers, without it the
+	# slot is abandoned for a later proposal to decide. Return True if event was chosen, False if another value
+	# was or the slot was abandoned
+	def settle_slot(self, slot, event, retry):
+		attempts = 0
+		while True:
+			v = self.decide_slot(slot, event)
+			if v is not None:
+				return v == event
+			if not retry:
+				self.abandon_slot(slot)
+				return False
 
-	# Return True/False if the event was successfully inserted into the latest available slot
-	def insert_event(self, event):
-		# Get next available slot
-		slot = self.log.get_next_available_slot()
+			attempts += 1
+			delay = self.retry_delay(attempts)
+			self.tracer.warning("RETRYING", SLOT = slot + 1, EVENT = event, ATTEMPT = attempts, DELAY = round(delay, 3))
+			time.sleep(delay)
 
-		self.increment_event_counter(slot)
-		n = (self.event_counter[slot],self.ID)
-		print("[PROPOSER] Slot: {} Proposal Number: {}".format(slot,n))
+	# Run the Synod Algorithm for slot with a new ballot, proposing value unless another value may already have
+	# been chosen. Return the value chosen (and committed), None if no majority answered
+	def decide_slot(self, slot, value):
+		# Already decided and learned
+		entry = self.log.get_entry(slot)
+		if entry is not None:
+			return entry
 
-		
-		# Leader can skip to ACCEPT stage, otherwise run PREPARE phase
-		if self.log.is_leader(slot, self.ID):
-			print("[PROPOSER] Leader for slot {}, skipping to ACCEPT phase".format(slot + 1))
-			v = event
-		else:
-			# PREPARE Phase
-			v = self.prepare_phase(slot, n, event)
-			
-			# If v is None, failed prepare phase
-			if v is None:
-				return False
-				
+		n = (self.increment_event_counter(slot), self.ID)
+		if trace_module.DEBUG_ENABLED:
+			self.tracer.debug("PROPOSING", SLOT = slot + 1, N = n)
+
+		# PREPARE Phase (only a Multi-Paxos leader, holding promises for every later slot, may skip it)
+		v = self.prepare_phase(slot, n, value)
+
+		# If v is None, failed prepare phase
+		if v is None:
+			return None
 
-		# ACCEPT phase, if it fails to receive majority ACKs, return False
+		# ACCEPT phase, if it fails to receive majority ACKs, return None
 		if not self.accept_phase(slot, n, v):
-			return False
+			return None
 
 		# Send commit message
 		self.commit(slot, v)
-		
-		#if self.local_run:
-		#	return True
+		return v
+
+	# Record that the proposal for slot gave up undecided
+	def abandon_slot(self, slot):
+		with self.lock:
+			self.abandoned_slots.add(slot)
+		self.tracer.warning("ABANDONED SLOT", SLOT = slot + 1)
+
+	# Submit an event to the leader's pipeline and return a Future resolved with True/False once it is decided.
+	# With retry, failed events are proposed again (in their slot, in a new one once another value is chosen
+	# there) until they commit
+	def submit_event(self, event, retry = False):
+		future = concurrent.futures.Future()
+		self.route((event, future, retry, 0))
+		return future
+
+	# Send (event, future, retry, failed attempts) to the leader: our own pipeline if we lead, a forward otherwise
+	def route(self, item):
+		leader = self.get_leader()
+		if leader == self.ID:
+			# An event forwarded before may still be committed by that leader, propose it under the same key
+			with self.lock:
+				seq = self.forward_seqs.get(item[1])
+			if (seq is not None) and (type(item[0]) is not Forwarded):
+				item = (Forwarded((self.ID, self.incarnation, seq), item[0]),) + item[1:]
+			self.enqueue(item)
+		else:
+			self.forward(item, leader)
+
+	# Queue (event, future, retry, failed attempts) for this proposer's pipeline
+	def enqueue(self, item):
+		if self.batching:
+			self.batch_queue.put(item)
+		else:
+			self.pipeline_queue.put(item)
+
+	# Resolve the future of (event, future, retry, failed attempts) with success, failed events with retry are
+	# routed again after a backoff (unless forwarded to us, the forwarder retries those)
+	def complete(self, item, success):
+		event, future, retry, attempts = item
+		if (not success) and retry and (type(future) is not ForwardedFuture):
+			self.retry_later((event, future, retry, attempts + 1))
+			return
+
+		with self.lock:
+			self.forward_seqs.pop(future, None)
+		future.set_result(success)
+
+	# Coroutine form of submit_event for callers running on the node runtime's event loop
+	async def insert_event_async(self, event, retry = False):
+		return await asyncio.wrap_future(self.submit_event(event, retry))
+
+	# Group submitted events into batches, each flushed after BATCH_MAX_DELAY or once a size limit is hit
+	def batcher(self):
+		while True:
+			# Block until the first event of the next batch arrives
+			pending = [self.batch_queue.get()]
+			size = len(wire_module.encode_value(pending[0][0]))
+			deadline = time.time() + BATCH_MAX_DELAY
+			while len(pending) < BATCH_MAX_EVENTS:
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					break
+				try:
+					item = self.batch_queue.get(timeout = remaining)
+				except queue.Empty:
+					break
+
+				# Start a new batch if this event would push the value past the size budget
+				item_size = len(wire_module.encode_value(item[0]))
+				if size + item_size > BATCH_MAX_BYTES:
+					self.submit_batch(pending)
+					pending, size = [], 0
+					deadline = time.time() + BATCH_MAX_DELAY
+				pending.append(item)
+				size += item_size
+			self.submit_batch(pending)
+
+	# Send a list of (event, future, retry, failed attempts) through the pipeline as one Batch value. The batch
+	# is retried as a whole (in its slot) if any of its events is, its events are never split over two slots
+	def submit_batch(self, pending):
+		# A lone event is proposed as is
+		if len(pending) == 1:
+			self.pipeline_queue.put(pending[0])
+			return
+
+		batch = Batch(self.log.username, [event for event, future, retry, attempts in pending])
+		batch_future = concurrent.futures.Future()
+		batch_future.add_done_callback(lambda f: self.complete_batch(pending, f.result()))
+		self.pipeline_queue.put((batch, batch_future, any([retry for event, future, retry, attempts in pending]), 0))
+
+	# Resolve the futures of every event in a batch
+	def complete_batch(self, pending, success):
+		for item in pending:
+			self.complete(item, success)
+
+	# Take submitted events off the pipeline queue and drive each through its own slot
+	def pipeline_worker(self):
+		while True:
+			item = self.pipeline_queue.get()
+			try:
+				success = self.insert_event(item[0], item[2])
+			except:
+				success = False
+
+			if success and trace_module.DEBUG_ENABLED:
+				self.tracer.debug("COMMITTED", EVENT = item[0])
+			self.complete(item, success)
+
+	# Route (event, future, retry, failed attempts) again after a jittered exponential backoff
+	def retry_later(self, item):
+		delay = self.retry_delay(item[3])
+		self.tracer.warning("RETRYING", EVENT = item[0], ATTEMPT = item[3], DELAY = round(delay, 3))
+		threading.Timer(delay, self.route, (item,)).start()
+
+	# Return the jittered exponential backoff before retrying after a number of failed attempts
+	def retry_delay(self, attempts):
+		return random.uniform(0, min(RETRY_BASE_DELAY * (2 ** min(attempts, 16)), RETRY_MAX_DELAY))
+
+	# Return the leader: the lowest server ID whose proposer was heard from within the lease (possibly us)
+	def get_leader(self):
+		if self.local_run or (not FORWARDING):
+			return self.ID
+		current_time = time.time()
+		alive = [server for server, heard in self.last_heard.items() if current_time - heard < LEASE_TIMEOUT]
+		return min(alive + [self.ID])
+
+	# Heartbeat thread: announce ourselves to every proposer, report leader changes, fail forwarded events the
+	# leader never answered and send those that went to a previous leader to the new one
+	def heartbeat(self):
+		leader = None
+		while True:
+			self.send_all_proposers({"TYPE": "HEARTBEAT", "ID": self.ID})
+
+			current_leader = self.get_leader()
+			if current_leader != leader:
+				self.tracer.info("LEADER", ID = current_leader)
+				leader = current_leader
+
+			# The previous leader may still commit an event it was forwarded, so it is not failed
+			current_time = time.time()
+			with self.lock:
+				expired = [seq for seq, (item, forwarded, forward_leader) in self.forwarded.items() \
+				if current_time - forwarded > FORWARD_TIMEOUT]
+				expired = [self.forwarded.pop(seq)[0] for seq in expired]
+				moved = [(seq, item) for seq, (item, forwarded, forward_leader) in self.forwarded.items() \
+				if forward_leader != current_leader]
+				for seq, item in moved:
+					self.forwarded[seq] = (item, self.forwarded[seq][1], current_leader)
+			for item in expired:
+				self.complete(item, False)
+			for seq, item in moved:
+				self.send_forward(seq, item, current_leader)
+
+			time.sleep(HEARTBEAT_FREQ)
+
+	# Forward (event, future, retry, failed attempts) to the leader's proposer, under the sequence number of
+	# its earlier forwards if retried
+	def forward(self, item, leader):
+		with self.lock:
+			seq = self.forward_seqs.get(item[1])
+			if seq is None:
+				self.forward_seq += 1
+				seq = self.forward_seq
+				self.forward_seqs[item[1]] = seq
+			self.forwarded[seq] = (item, time.time(), leader)
+		self.send_forward(seq, item, leader)
+
+	# Send the event of (event, future, retry, failed attempts) forwarded under seq to the leader, wrapped with
+	# its key so it is applied once however many leaders commit it
+	def send_forward(self, seq, item, leader):
+		event = item[0] if type(item[0]) is Forwarded else Forwarded((self.ID, self.incarnation, seq), item[0])
+		msg = {"TYPE": "FORWARD", "SEQ": seq, "EVENT": event, "ID": self.ID}
+		self.send_msg(self.server_config[leader]["IP"], self.server_config[leader]["PROPOSER_PORT"], msg)
+
+	# Propose an event forwarded by another server and send it the result. It is proposed here even if we no
+	# longer consider ourselves leader, forwarding it on could loop. A retried forward is never proposed twice:
+	# one still in progress is ignored, a committed one gets its result again. The event is retried in its
+	# slot until it commits, so a failure means no slot holds it and the forwarder may safely retry
+	def receive_forward(self, msg):
+		ID, seq, event = msg["ID"], msg["SEQ"], msg["EVENT"]
+		if type(event) is not Forwarded:
+			event = Forwarded((ID, seq), event)
+		key = event.key
+		with self.lock:
+			if key in self.forwards_in_progress:
+				return
+			result = self.forward_results.get(key)
+			if result is None:
+				self.forwards_in_progress.add(key)
+		if result is not None:
+			self.send_forward_result(ID, seq, result)
+			return
+
+		future = ForwardedFuture()
+		future.add_done_callback(lambda f: self.finish_forward(ID, seq, key, f.result()))
+		self.enqueue((event, future, True, 0))
+
+	# Remember the result of a committed forwarded event and send it to the forwarder
+	def finish_forward(self, ID, seq, key, result):
+		with self.lock:
+			self.forwards_in_progress.discard(key)
+			if result:
+				self.forward_results[key] = result
+				while len(self.forward_results) > FORWARD_RESULTS_MAX:
+					self.forward_results.popitem(last = False)
+		self.send_forward_result(ID, seq, result)
+
+	# Send the result of event seq forwarded by server ID
+	def send_forward_result(self, ID, seq, result):
+		msg = {"TYPE": "FORWARD_RESULT", "SEQ": seq, "RESULT": result, "ID": self.ID}
+		self.send_msg(self.server_config[ID]["IP"], self.server_config[ID]["PROPOSER_PORT"], msg)
+
+	# Resolve the event we forwarded with the leader's result
+	def receive_forward_result(self, msg):
+		with self.lock:
+			entry = self.forwarded.pop(msg["SEQ"], None)
+		if entry is not None:
+			self.complete(entry[0], msg["RESULT"])
+
+	# Multi-Paxos insertion: elect ourselves once, then every slot only needs the ACCEPT phase
+	def insert_event_as_leader(self, event, retry = False):
+		while True:
+			# No slot is bound to the event before it is elected, it can be routed again
+			if self.leader_ballot is None:
+				with self.election_lock:
+					if (self.leader_ballot is None) and (not self.elect_leader()):
+						return False
+
+			with self.lock:
+				n = self.leader_ballot
+			if n is None:
+				return False
+			slot = self.allocate_slot()
+			if trace_module.DEBUG_ENABLED:
+				self.tracer.debug("SKIPPING PREPARE", SLOT = slot + 1, N = n)
+
+			if self.accept_phase(slot, n, event):
+				self.commit(slot, event)
+				return True
+
+			# A missing majority means another proposer took over with a higher ballot. The event may still
+			# have been accepted by some acceptors, so it stays in its slot (proposed above our leader ballot)
+			self.resign_leadership()
+			self.observe_ballot(slot, n)
+			if self.settle_slot(slot, event, retry):
+				return True
+			if not retry:
+				return False
+
+	# Run one PREPARE phase for every slot from the lowest slot we abandoned (the next available slot if none)
+	# onward. Values already accepted in that range are re-driven under our ballot, abandoned slots nobody
+	# accepted a value for are filled with a no-op, before any new slot is used. Return True on success
+	def elect_leader(self):
+		with self.lock:
+			abandoned = sorted(self.abandoned_slots)
+		slot = min(abandoned + [max(self.log.get_next_available_slot(), self.next_slot)])
+		self.leader_round = max(self.leader_round, max(self.event_counter)) + 1
+		n = (self.leader_round, self.ID)
+		self.tracer.info("REQUESTING LEADERSHIP", SLOT = slot + 1, N = n)
+
+		# Send proposal for all slots >= slot and wait for Promise Messages
+		tracker = self.open_quorum("PROMISE_ALL", slot, n)
+		self.propose_all(slot, n)
+		responses = self.await_quorum(tracker, lambda: self.get_promises_all(slot, n))
+
+		if len(responses) < self.majority_size:
+			self.tracer.warning("NO MAJORITY", TYPE = "PROMISE_ALL", SLOT = slot + 1, N = n)
+			return False
+
+		# For each slot keep the value accepted with the highest ballot
+		accepted = dict()
+		for response in responses:
+			for acc_slot, (acc_num, acc_val) in response.items():
+				if (acc_slot not in accepted) or (acc_num > accepted[acc_slot][0]):
+					accepted[acc_slot] = (acc_num, acc_val)
+		for abandoned_slot in abandoned:
+			if (abandoned_slot not in accepted) and (self.log.get_entry(abandoned_slot) is None):
+				accepted[abandoned_slot] = (None, NoOp())
+
+		with self.lock:
+			self.leader_ballot = n
+			if len(accepted) > 0:
+				self.next_slot = max(self.next_slot, slot, max(accepted) + 1)
+			else:
+				self.next_slot = max(self.next_slot, slot)
+
+		# Finish any slot a previous leader may have chosen
+		for acc_slot in sorted(accepted):
+			v = accepted[acc_slot][1]
+			if not self.accept_phase(acc_slot, n, v):
+				self.resign_leadership()
+				return False
+			self.commit(acc_slot, v)
+
+		with self.lock:
+			self.abandoned_slots.difference_update(abandoned)
+
+		self.tracer.info("ELECTED LEADER", SLOT = slot + 1, N = n)
+		return True
+
+	# Give up leadership, the next insertion will run a new election
+	def resign_leadership(self):
+		with self.lock:
+			if self.leader_ballot is not None:
+				self.tracer.info("LOST LEADERSHIP", N = self.leader_ballot)
+			self.leader_ballot = None
+
+	# Reserve the next slot for this proposer. Per-slot Paxos first reuses abandoned slots: a new proposal there
+	# either finishes the value a majority may have accepted or is chosen itself. A Multi-Paxos leader leaves
+	# them to the next election, its ballot may already have been accepted there for another value
+	def allocate_slot(self):
+		with self.lock:
+			if (not MULTI_PAXOS) and (len(self.abandoned_slots) > 0):
+				slot = min(self.abandoned_slots)
+				self.abandoned_slots.discard(slot)
+				return slot
+			slot = max(self.next_slot, self.log.get_next_available_slot())
+			self.next_slot = slot + 1
+			return slot
 
-		# Return True / False depending on whether the value commited
-		# was the original event we were trying to insert
-		return v == event
-		
 	# PREPARE Phase: Return None on failure, otherwise return v (the entry to be used for the accept phase)
 	def prepare_phase(self, slot, n, event):
-		# Send proposal
+		# Send proposal and wait for Promise Messages
+		tracker = self.open_quorum("PROMISE", slot, n)
 		self.propose(slot, n)
-
-		# Wait for Promise Messages
-		current_time = time.time()
-		while ((time.time() - current_time) < TIMEOUT) and (len(self.get_promises(slot)) < self.majority_size):
-			time.sleep(.01)
-		responses = self.get_promises(slot)
+		responses = self.await_quorum(tracker, lambda: self.get_promises(slot, n))
 
 		# If not enough responses received, return None as the prepare phase failed
 		if len(responses) < self.majority_size:
-			print("[PROPOSER] Failure to receive majority of promise messages")
+			self.tracer.warning("NO MAJORITY", TYPE = "PROMISE", SLOT = slot + 1, N = n)
 			return None
 
 		# Display received messages
-		self.display_promise_messages(responses)
+		if trace_module.DEBUG_ENABLED:
+			self.display_promise_messages(slot, responses)
 
 		# Filter out responses with null values
 		responses = list(filter(lambda x: (x[0] is not None) and (x[1] is not None), responses))
@@ -166,99 +774,47 @@ class Proposer():
 		
 	# ACCEPT Phase: Return True if majority of acks are received
 	def accept_phase(self, slot, n, v):
-		# Send accept message
+		# Send accept message and wait for ACK Messages
+		tracker = self.open_quorum("ACK", slot, n)
 		self.accept(slot, n, v)
-
-		# Wait for ACK Messages
-		current_time = time.time()
-		while ((time.time() - current_time) < TIMEOUT) and (len(self.get_acks(slot)) < self.majority_size):
-			time.sleep(.01)
-		responses = self.get_acks(slot)
+		responses = self.await_quorum(tracker, lambda: self.get_acks(slot, n))
 
 		# If not enough responses received, return False as the prepare phase failed
 		if len(responses) < self.majority_size:
-			print("[PROPOSER] Failure to receive majority of ACK messages")
+			self.tracer.warning("NO MAJORITY", TYPE = "ACK", SLOT = slot + 1, N = n)
 			return False
 		
 		return True
 		
 
-	# Return True/False if the event was successfully inserted into the latest available slot
-	def learn_slot(self, slot, updating_log = False):
-		event = 0
-		
-		# Send proposal
-		self.increment_event_counter(slot)
+	# Learn a slot beyond our log: read what the acceptors accepted for it (ballot (0, 0) only reads) and if any
+	# accepted a value, decide the slot with a real ballot. That finishes a value that may have been chosen and
+	# fills the slot with a no-op otherwise, a value only some acceptors accepted is never committed as is.
+	# Return True if a value was committed
+	def learn_slot(self, slot):
 		n = (0,0)
-		print("[PROPOSER] Slot: {} Proposal Number: {}".format(slot + 1, n))
-		
-		# Leader can skip to ACCEPT stage, otherwise run PREPARE phase
-		if self.log.is_leader(slot, self.ID):
-			print("[PROPOSER] Leader for slot {}, skipping to ACCEPT phase".format(slot + 1))
-			v = event
-		else:
-			self.propose(slot, n)
-
-			# Wait for Promise Messages
-			current_time = time.time()
-			while ((time.time() - current_time) < TIMEOUT) and (len(self.get_promises(slot)) < self.majority_size):
-				time.sleep(.01)
-			responses = self.get_promises(slot)
-
-			# If not enough responses received, return False as the insertion failed
-			if len(responses) < self.majority_size:
-				print("[PROPOSER] Failure to receive majority of promise messages")
-				if updating_log:
-					return True
-				else:
-					return False
-
-			# Display received messages
-			self.display_promise_messages(responses)
-
-			# Filter out responses with null values
-			responses = list(filter(lambda x: (x[0] is not None) and (x[1] is not None), responses))
-
-			# Determine v to use
-			if len(responses) == 0:
-				if updating_log:
-					return True
-				else:
-					return False
-			else:
-				responses.sort(key=lambda x: x[0])
-				v = responses[-1][1]
-
-		# Send accept message
-		self.accept(slot, n, v)
+		if trace_module.DEBUG_ENABLED:
+			self.tracer.debug("LEARNING", SLOT = slot + 1, N = n)
 
-		# Wait for ACK Messages
-		current_time = time.time()
-		while ((time.time() - current_time) < TIMEOUT) and (len(self.get_acks(slot)) < self.majority_size):
-			time.sleep(.01)
-		responses = self.get_acks(slot)
+		# Read the value accepted for the slot, if any
+		tracker = self.open_quorum("PROMISE", slot, n)
+		self.propose(slot, n)
+		responses = self.await_quorum(tracker, lambda: self.get_promises(slot, n))
 
-		# If not enough responses received, return False as the insertion failed
+		# If not enough responses received, nothing can be learned
 		if len(responses) < self.majority_size:
-			print("[PROPOSER] Failure to receive majority of ACK messages")
+			self.tracer.warning("NO MAJORITY", TYPE = "PROMISE", SLOT = slot + 1, N = n)
 			return False
-			
-		# Filter out responses with null values
-		responses = list(filter(lambda x: (x[0] is not None) and (x[1] is not None), responses))
-		
-		if len(responses) == 0 and updating_log:
-			return True
-			
-		responses.sort(key=lambda x: x[0])
-		v = responses[-1][1]
 
-		# Send commit message
-		self.commit(slot, v)
+		# Display received messages
+		if trace_module.DEBUG_ENABLED:
+			self.display_promise_messages(slot, responses)
 
-		if updating_log:
+		# No acceptor holds a value for the slot, there is nothing to learn
+		if all([acc_val is None for acc_num, acc_val in responses]):
 			return False
-			
-		return True
+
+		return self.decide_slot(slot, NoOp()) is not None
 
 
 	# Send propose message to all acceptors
@@ -266,6 +822,11 @@ class Proposer():
 		msg = {"TYPE": "PROPOSE", "SLOT": slot, "N": n, "ID": self.ID}
 		self.send_all_acceptors(msg)
 
+	# Send a propose message covering every slot >= slot to all acceptors
+	def propose_all(self, slot, n):
+		msg = {"TYPE": "PROPOSE_ALL", "SLOT": slot, "N": n, "ID": self.ID}
+		self.send_all_acceptors(msg)
+
 	# Send accept message to all acceptors
 	def accept(self, slot, n, event):
 		msg = {"TYPE": "ACCEPT", "SLOT": slot, "N": n, "EVENT": event, "ID": self.ID}
@@ -277,64 +838,178 @@ class Proposer():
 		msg = {"TYPE": "COMMIT", "SLOT": slot, "EVENT": event, "ID": self.ID}
 		self.send_all_learners(msg)
 
-	# Return all promises on the message queue which correspond to slot
-	def get_promises(self, slot):
-		promises = []
-		for timestamp, msg in self.message_buffer:
-			if (msg["TYPE"] == "PROMISE") and (msg["SLOT"] == slot):
-				promises.append((msg["ACC_NUM"], msg["ACC_VAL"]))
-		return promises
+	# Register a quorum tracker before sending, so no response can arrive unnoticed
+	def open_quorum(self, msg_type, slot, n):
+		tracker = QuorumTracker((msg_type, slot, n), self.majority_size, len(self.server_config) - self.majority_size)
+		self.quorum_trackers[tracker.key] = tracker
+		self.rtt.start(tracker.key)
+		return tracker
+
+	# Wait until a majority of responses is buffered or the acceptors' round-trip times say they are not
+	# coming, then return get_responses()
+	def await_quorum(self, tracker, get_responses):
+		try:
+			tracker.wait(lambda: self.message_buffer.count(tracker.key), self.rtt.quorum_timeout(self.server_config))
+		finally:
+			if self.quorum_trackers.get(tracker.key) is tracker:
+				del self.quorum_trackers[tracker.key]
+
+		# Wait longer for the acceptors that did not respond next time
+		responses = self.message_buffer.get(tracker.key)
+		if (len(responses) < self.majority_size) and (not tracker.aborted()):
+			responded = set([msg["ID"] for msg in responses + self.message_buffer.get(("NACK",) + tracker.key[1:])])
+			self.rtt.back_off([ID for ID in self.server_config if ID not in responded])
+		return get_responses()
+
+	# Return all promises on the message queue which correspond to slot and ballot n
+	def get_promises(self, slot, n):
+		return [(msg["ACC_NUM"], msg["ACC_VAL"]) for msg in self.message_buffer.get(("PROMISE", slot, n))]
 
-	# Return all acks on the message queue which correspond to slot
-	def get_acks(self, slot):
-		acks = []
-		for timestamp, msg in self.message_buffer:
-			if (msg["TYPE"] == "ACK") and (msg["SLOT"] == slot):
-				acks.append((msg["ACC_NUM"], msg["ACC_VAL"]))
-		return acks
+	# Return the accepted values ({slot: (acc num, acc val)}) of each leader promise for slot and ballot n
+	def get_promises_all(self, slot, n):
+		return [msg["ACCEPTED"] for msg in self.message_buffer.get(("PROMISE_ALL", slot, n))]
 
-	# Clear the message buffer
-	def clear_buffer(self):
-		self.message_buffer = []
+	# Return all acks on the message queue which correspond to slot and ballot n
+	def get_acks(self, slot, n):
+		return [(msg["ACC_NUM"], msg["ACC_VAL"]) for msg in self.message_buffer.get(("ACK", slot, n))]
 
 
 	# returns a list of indices where any holes exist in the log
 	def find_holes(self):
-		holes = []
-		log = self.log.get_log()
-		end = self.log.get_next_available_slot()
-		for i in range(end - 2, -1, -1):
-			if log[i] is None:
-				holes.append(i)
-		return holes[::-1]
-
-	# Search the log for gaps of knowledge. Fill these in with Synod Algorithm
-	# thread that runs continuously, every 60 seconds it
+		return self.log.get_holes()
+
+	# Search the log for gaps of knowledge. Fill these in from the other servers' logs, or with the Synod
+	# Algorithm for slots none of them has. Runs as soon as the log reports new holes
 	def hole_filler(self):
 		while True:
-			time.sleep(60)
+			self.log.holes_detected.wait(HOLE_CHECK_FREQ)
+			self.log.holes_detected.clear()
+			time.sleep(HOLE_GRACE)
 			holes = self.find_holes()
 			if len(holes) == 0:
-				print("[HOLE DETECTOR] No holes found")
+				continue
+			self.tracer.info("HOLES DETECTED", HOLES = len(holes))
+			list(self.hole_executor.map(self.fill_range, self.group_holes(holes)))
+
+	# Group sorted holes into [start, end) ranges, holes less than HOLE_RANGE_GAP slots apart share a range
+	def group_holes(self, holes):
+		ranges = []
+		for slot in holes:
+			if (len(ranges) > 0) and (slot - ranges[-1][1] < HOLE_RANGE_GAP):
+				ranges[-1][1] = slot + 1
 			else:
-				print("[HOLE DETECTOR] Found the following holes in the log:", holes)
-			for slot in holes:
-				self.learn_slot(slot, False)
+				ranges.append([slot, slot + 1])
+		return [tuple(hole_range) for hole_range in ranges]
+
+	# Fill the holes in [start, end) with one range request per server, then run the Synod Algorithm for
+	# the slots still empty
+	def fill_range(self, hole_range):
+		start, end = hole_range
+		peers = [ID for ID in self.server_config if ID != self.ID]
+		for i in range(len(peers)):
+			# Spread the ranges over the servers
+			ID = peers[(start + i) % len(peers)]
+			while self.request_catchup(ID, start, end):
+				pass
+			if self.log.count_filled(start, end) == end - start:
+				return
+
+		# A later slot was committed, so each hole gets a value: the one a majority may have chosen or a no-op
+		for slot in range(start, end):
+			if not self.log.is_filled(slot):
+				self.decide_slot(slot, NoOp())
+
+	# Periodically tell every acceptor the slot below which our log is covered by a snapshot (committed and
+	# durable). Once every server has reported past a slot, acceptors can discard their state for it
+	def watermark_reporter(self):
+		while True:
+			time.sleep(WATERMARK_FREQ)
+			msg = {"TYPE": "WATERMARK", "SLOT": self.log.get_snapshot_slot(), "ID": self.ID}
+			self.send_all_acceptors(msg)
 
-	# Attempt to learn newer entries beyond the latest known log entry
+	# Catch up with the other servers: stream their committed entries first, then learn newer entries beyond
+	# the latest known log entry with the Synod Algorithm
 	def update_log(self):
-		done = False
-		while not done:
-			self.clear_buffer()
-			slot = self.log.get_next_available_slot()
-			done = self.learn_slot(slot, True)
+		self.catch_up()
+
+		while self.learn_slot(self.log.get_next_available_slot()):
 			time.sleep(0.1)
 
-	# Increment event counter for a particular slot
+	# Request every committed entry from our contiguous prefix on from each other server's learner in turn
+	def catch_up(self):
+		for ID in self.server_config:
+			if ID == self.ID:
+				continue
+			while self.request_catchup(ID, self.log.get_contiguous_prefix(), None):
+				pass
+
+	# Ask server ID's learner for the committed entries in [start, end) (end None for all) and wait for the
+	# stream to be applied. Return True if it made progress and asking the same server again may make more
+	def request_catchup(self, ID, start, end):
+		self.tracer.info("REQUESTING ENTRIES", SLOT = start + 1, SERVER = ID)
+
+		# Progress is our contiguous prefix, or the number of filled slots for a range
+		if end is None:
+			progress = self.log.get_contiguous_prefix
+		else:
+			progress = lambda: self.log.count_filled(start, end)
+		initial = progress()
+
+		tracker = QuorumTracker(("CATCHUP_DONE", start, None), 1)
+		self.quorum_trackers[tracker.key] = tracker
+		msg = {"TYPE": "CATCHUP_REQUEST", "SLOT": start, "END": end, "ID": self.ID}
+		self.send_msg(self.server_config[ID]["IP"], self.server_config[ID]["LEARNER_PORT"], msg)
+
+		# Keep waiting for the end of the stream while entries are still arriving
+		last = initial
+		try:
+			while True:
+				tracker.wait(lambda: self.message_buffer.count(tracker.key), TIMEOUT)
+				if (self.message_buffer.count(tracker.key) > 0) or (progress() == last):
+					break
+				last = progress()
+		finally:
+			if self.quorum_trackers.get(tracker.key) is tracker:
+				del self.quorum_trackers[tracker.key]
+
+		responses = self.message_buffer.get(tracker.key)
+		if len(responses) == 0:
+			return progress() > initial
+
+		# The server has every slot below its prefix, the stream is complete once we have them too
+		target = min(responses[0]["END"], responses[0]["PREFIX"])
+		if end is None:
+			complete = lambda: self.log.get_contiguous_prefix() >= target
+		else:
+			target = max(min(end, target), start)
+			complete = lambda: self.log.count_filled(start, target) == target - start
+
+		# The last datagrams may still be in flight, wait until the stream is applied or stops advancing
+		last = None
+		while (not complete()) and (progress() != last):
+			last = progress()
+			time.sleep(TIMEOUT)
+
+		# Asking again only helps if datagrams were lost
+		return (progress() > initial) and (not complete())
+
+	# Make our next ballots for slot, and for leadership, higher than ballot n promised by an acceptor
+	def observe_ballot(self, slot, n):
+		if n is None:
+			return
+		with self.lock:
+			self.leader_round = max(self.leader_round, n[0])
+			while len(self.event_counter) - 1 < slot:
+				self.extend_event_counter_list()
+			self.event_counter[slot] = max(self.event_counter[slot], n[0])
+
+	# Increment event counter for a particular slot and return the new count
 	def increment_event_counter(self, slot):
-		while len(self.event_counter) - 1 < slot:
-			self.extend_event_counter_list()
-		self.event_counter[slot] += 1
+		with self.lock:
+			while len(self.event_counter) - 1 < slot:
+				self.extend_event_counter_list()
+			self.event_counter[slot] += 1
+			return self.event_counter[slot]
 
 	# Extend the event counter list to twice it's size
 	def extend_event_counter_list(self):
@@ -342,61 +1017,15 @@ class Proposer():
 		self.event_counter.extend([0] * size)
 
 
-	# Given a destination IP and port, send a message
-	def send_msg(self, dest_ip, dest_port, message):
-		try:
-			# Display Debug Information
-			s1 = "Server: [{}   {}]".format(self.ID, "PROPOSER")
-			s2 = "Status: [{} {}]".format("SENDING", message["TYPE"])
-			s3 = "Destination: [{}:{}]".format(dest_ip, dest_port)
-			print("{:<40} {:<40} {:<40}".format(s1, s2, s3))
-
-			# Send Message
-			msg = pickle.dumps(message)
-			self.send_sock.sendto(msg, (dest_ip, dest_port))
-		except:
-			pass
-
-	# Send message to all proposers (including self) -> Used for debug purposes
-	def send_all_proposers(self, message):
-		for ID in self.server_config:
-			dest_ip = self.server_config[ID]["IP"]
-			dest_port = self.server_config[ID]["PROPOSER_PORT"]
-			self.send_msg(dest_ip, dest_port, message)
-
-	# Send message to all acceptors
-	def send_all_acceptors(self, message):
-		for ID in self.server_config:
-			dest_ip = self.server_config[ID]["IP"]
-			dest_port = self.server_config[ID]["ACCEPTOR_PORT"]
-			self.send_msg(dest_ip, dest_port, message)
-
-	# Send message to all learners
-	def send_all_learners(self, message):
-		for ID in self.server_config:
-			dest_ip = self.server_config[ID]["IP"]
-			dest_port = self.server_config[ID]["LEARNER_PORT"]
-			self.send_msg(dest_ip, dest_port, message)
-			
-		if self.local_run:
-			self.send_msg('127.0.0.1', 9023, message)
-
 	# Garbage Collection for Message Buffer
 	def message_buffer_garbage_collector(self):
 		while True:
-			# Remove expired messages from the front of the queue
-			current_time = time.time()
-			while (len(self.message_buffer) > 0) and (current_time - self.message_buffer[0][0] > TIMEOUT):
-				self.message_buffer.pop(0)
+			# Remove expired messages from the front of the queue, and phases too old to be measured
+			self.message_buffer.expire(time.time())
+			self.rtt.expire(time.time())
 			# Wait before running garbage collection again
 			time.sleep(GARBAGE_COLLECT_FREQ)
 
-	def display_promise_messages(self, messages):
-		output = "[PROPOSER] Received a majority of promise messages:"
-		for acc_num, acc_val in messages:
-			output += " ({},{})".format(acc_num, acc_val)
-		print(output)
-
-	# Drop the requested number of messages in the listening thread
-	def drop_messages(self, num_messages):
-		self.drop_counter = num_messages
+	def display_promise_messages(self, slot, messages):
+		output = " ".join(["({},{})".format(acc_num, acc_val) for acc_num, acc_val in messages])
+		self.tracer.debug("PROMISE MAJORITY", SLOT = slot + 1, PROMISES = output)
@@ -4,6 +4,9 @@ import log_module
 import proposer_module
 import acceptor_module
 import learner_module
+import runtime_module
+import transport_module
+import trace_module
 from event_module import *
 import time
 import socket
@@ -50,6 +53,15 @@ def show_commands(valid_commands):
 	print("{:^120} ".format("   ".join(valid_commands)))
 	print("-" * 120)
 
+# Show the message counters (and worker queue metrics) of each role
+def show_stats(roles):
+	for role in roles:
+		role.tracer.view_counters(role.workers.metrics() if role.workers is not None else None)
+
+# Tell the user once the event of a submitted future ("tweet", "block" or "unblock") is committed or has failed
+def report_completion(future, action):
+	future.add_done_callback(lambda f: print("{} committed.".format(action.title()) if f.result() else "Failure to {}.".format(action)))
+
 
 ### Message Sending Test ###
 def message_test(proposer):
@@ -69,7 +81,7 @@ def message_test(proposer):
 	print("\nPROPOSER SENDING TO ALL LEARNERS...")
 	proposer.send_all_learners(message)
 	time.sleep(0.5)
-	print("-" * 120)
+	proposer.tracer.view_counters()
 	
 # Get the server ID for the local host
 def get_server_ID(all_servers):
@@ -94,10 +106,16 @@ if __name__ == "__main__":
 	# Initialize the log
 	log = log_module.Log(server_ID, all_servers, username)
 
+	# Transport shared by the proposer, acceptor and learner (transport_module.TRANSPORT selects UDP or TCP)
+	transport = transport_module.create_transport()
+
+	# Start the node runtime (one event loop serving the proposer, acceptor and learner ports)
+	runtime = runtime_module.NodeRuntime(transport)
+
 	# Create proposer, acceptor, and learner
-	proposer = proposer_module.Proposer(server_ID, all_servers, log)
-	acceptor = acceptor_module.Acceptor(server_ID, all_servers)
-	learner = learner_module.Learner(server_ID, all_servers, log)
+	proposer = proposer_module.Proposer(server_ID, all_servers, log, runtime = runtime, transport = transport)
+	acceptor = acceptor_module.Acceptor(server_ID, all_servers, runtime = runtime, transport = transport)
+	learner = learner_module.Learner(server_ID, all_servers, log, runtime = runtime, transport = transport)
 
 	# Message Sending Test
 	message_test(proposer)
@@ -105,7 +123,7 @@ if __name__ == "__main__":
 	proposer.update_log()
 
 	# GUI - Terminate on Quit/Exit Command
-	valid_commands = ["tweet", "block", "unblock", "view", "blocklist", "log", "servers", "drop", "commands", "exit"]
+	valid_commands = ["tweet", "block", "unblock", "view", "more", "blocklist", "log", "servers", "drop", "stats", "trace", "commands", "exit"]
 	show_commands(valid_commands)
 	while True:
 		text = input("({}) Message => ".format(username))
@@ -123,7 +141,14 @@ if __name__ == "__main__":
 			show_server_config(all_servers)
 
 		elif command == "view":
-			log.view_timeline()
+			# Latest page of the timeline (optionally "view N" for N tweets)
+			if (len(parsed_text) == 1) and parsed_text[0].isdigit():
+				log.view_timeline(int(parsed_text[0]))
+			else:
+				log.view_timeline()
+
+		elif command == "more":
+			log.view_timeline(more = True)
 
 		elif command == "log":
 			log.view_log()
@@ -132,11 +157,9 @@ if __name__ == "__main__":
 			log.view_blocklist()
 
 		elif command == "tweet":
-			# Repeatedly run the synod algorithm until successful
+			# Hand the event to the pipelined proposer, which retries until it commits, and report when it does
 			event = Tweet(username, " ".join(parsed_text))
-			while not proposer.insert_event(event):
-				print("Failure to tweet, retrying in 10 seconds.")
-				time.sleep(10)
+			report_completion(proposer.submit_event(event, retry = True), "tweet")
 
 		elif command == "block":
 			blockee = " ".join(parsed_text).title()
@@ -144,11 +167,9 @@ if __name__ == "__main__":
 				print("Error: You can not block yourself.")
 				continue
 
-			# Repeatedly run the synod algorithm until successful
+			# Hand the event to the pipelined proposer, which retries until it commits, and report when it does
 			event = InsertBlock(username, blockee)
-			while not proposer.insert_event(event):
-				print("Failure to block, retrying in 10 seconds.")
-				time.sleep(10)
+			report_completion(proposer.submit_event(event, retry = True), "block")
 
 		elif command == "unblock":
 			blockee = " ".join(parsed_text).title()
@@ -156,11 +177,9 @@ if __name__ == "__main__":
 				print("Error: You can not unblock yourself.")
 				continue
 
-			# Repeatedly run the synod algorithm until successful
+			# Hand the event to the pipelined proposer, which retries until it commits, and report when it does
 			event = DeleteBlock(username, blockee)
-			while not proposer.insert_event(event):
-				print("Failure to unblock, retrying in 10 seconds.")
-				time.sleep(10)
+			report_completion(proposer.submit_event(event, retry = True), "unblock")
 
 		elif command == "drop":
 			if len(parsed_text) != 2:
@@ -179,5 +198,13 @@ if __name__ == "__main__":
 		elif command == "commands":
 			show_commands(valid_commands)
 
+		elif command == "stats":
+			show_stats([proposer, acceptor, learner])
+
+		elif command == "trace":
+			if (len(parsed_text) != 1) or (parsed_text[0].upper() not in ["DEBUG", "INFO", "WARNING", "ERROR"]):
+				continue
+			trace_module.set_level(getattr(trace_module, parsed_text[0].upper()))
+
 		elif command == "exit":
 			break
@@ -4,6 +4,8 @@ import log_module
 import proposer_module
 import acceptor_module
 import learner_module
+import runtime_module
+import transport_module
 from event_module import *
 import time
 import socket
@@ -96,10 +98,16 @@ if __name__ == "__main__":
 	# Initialize the log
 	log = log_module.Log(server_ID, all_servers, username)
 
+	# Transport shared by the proposer, acceptor and learner (transport_module.TRANSPORT selects UDP or TCP)
+	transport = transport_module.create_transport()
+
+	# Start the node runtime (one event loop serving the proposer, acceptor and learner ports)
+	runtime = runtime_module.NodeRuntime(transport)
+
 	# Create proposer, acceptor, and learner
-	proposer = proposer_module.Proposer(server_ID, all_servers, log)
-	acceptor = acceptor_module.Acceptor(server_ID, all_servers)
-	learner = learner_module.Learner(server_ID, all_servers, log)
+	proposer = proposer_module.Proposer(server_ID, all_servers, log, runtime = runtime, transport = transport)
+	acceptor = acceptor_module.Acceptor(server_ID, all_servers, runtime = runtime, transport = transport)
+	learner = learner_module.Learner(server_ID, all_servers, log, runtime = runtime, transport = transport)
 
 	# Message Sending Test
 	# message_test(proposer)
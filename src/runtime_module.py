@@ -0,0 +1,95 @@
+import asyncio
+import _thread
+import threading
+import transport_module
+import wire_module
+
+# Datagram endpoint handing every received packet to a role (Proposer, Acceptor or Learner) as a coroutine
+class RoleProtocol(asyncio.DatagramProtocol):
+	def __init__(self, role):
+		self.role = role
+
+	# Keep the transport so the endpoint can be closed later
+	def connection_made(self, transport):
+		self.transport = transport
+
+	# Schedule the role's handler for every message in the datagram on the event loop instead of spawning a thread
+	def datagram_received(self, data, source):
+		for msg in wire_module.unbundle(data):
+			asyncio.ensure_future(self.role.handle_datagram(msg, source))
+
+	# Ignore ICMP errors (unreachable peers), the protocol already tolerates lost messages
+	def error_received(self, exc):
+		pass
+
+
+# Stream endpoint splitting a connection's bytes into frames, each handed to the role like a datagram
+class StreamRoleProtocol(asyncio.Protocol):
+	def __init__(self, role):
+		self.role = role
+		self.buffer = bytearray()
+
+	# Keep the transport and the peer address (the source of every frame)
+	def connection_made(self, transport):
+		self.transport = transport
+		self.source = transport.get_extra_info("peername")
+
+	# Schedule the role's handler for every message in every complete frame
+	def data_received(self, data):
+		self.buffer += data
+		header_size = transport_module.FRAME_HEADER.size
+		while len(self.buffer) >= header_size:
+			length, = transport_module.FRAME_HEADER.unpack_from(self.buffer, 0)
+			if length > transport_module.MAX_FRAME_SIZE:
+				self.transport.close()
+				return
+			if len(self.buffer) < header_size + length:
+				break
+			data = bytes(self.buffer[header_size:header_size + length])
+			del self.buffer[:header_size + length]
+			for msg in wire_module.unbundle(data):
+				asyncio.ensure_future(self.role.handle_datagram(msg, self.source))
+
+
+# Node Runtime Class: one event loop per process serving the PROPOSER/ACCEPTOR/LEARNER ports
+class NodeRuntime():
+	def __init__(self, transport = None):
+		self.loop = asyncio.new_event_loop()
+		self.transports = []
+
+		# Serve framed streams instead of datagrams when the node sends over a stream transport
+		self.stream = (transport is not None) and transport.stream
+
+		# Run the event loop on its own thread so the user interface keeps the main thread
+		started = threading.Event()
+		_thread.start_new_thread(self.run, (started,))
+		started.wait()
+
+	# Event loop thread
+	def run(self, started):
+		asyncio.set_event_loop(self.loop)
+		self.loop.call_soon(started.set)
+		self.loop.run_forever()
+
+	# Bind an endpoint on port whose datagrams (or frames) are handled by role.handle_datagram
+	def register(self, role, port):
+		transport = self.run_coroutine(self.create_endpoint(role, port)).result()
+		self.transports.append(transport)
+		return transport
+
+	# Create the datagram endpoint (runs on the event loop)
+	async def create_endpoint(self, role, port):
+		if self.stream:
+			return await self.loop.create_server(lambda: StreamRoleProtocol(role), '0.0.0.0', port, reuse_address = True)
+		transport, protocol = await self.loop.create_datagram_endpoint(lambda: RoleProtocol(role), local_addr = ('0.0.0.0', port))
+		return transport
+
+	# Run a coroutine on the event loop from any thread, return a concurrent.futures.Future for its result
+	def run_coroutine(self, coro):
+		return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+	# Close every endpoint and stop the event loop
+	def stop(self):
+		for transport in self.transports:
+			self.loop.call_soon_threadsafe(transport.close)
+		self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,104 @@
+import sys
+import time
+import _thread
+import collections
+
+# Trace levels, a trace message is written when its level is at least LEVEL
+ERROR = 40
+WARNING = 30
+INFO = 20
+DEBUG = 10
+
+LEVEL_NAMES = {ERROR: "ERROR", WARNING: "WARNING", INFO: "INFO", DEBUG: "DEBUG"}
+
+# Level traced by every role, DEBUG adds a line for every message sent and received
+LEVEL = INFO
+
+# Switches checked by call sites before building a trace message, so a disabled level costs a single
+# attribute lookup and no formatting:  if trace_module.DEBUG_ENABLED: tracer.debug("RECEIVED", TYPE = ...)
+DEBUG_ENABLED = LEVEL <= DEBUG
+
+# Set the level traced by every role
+def set_level(level):
+	global LEVEL, DEBUG_ENABLED
+	LEVEL = level
+	DEBUG_ENABLED = level <= DEBUG
+
+
+# Message counts by kind (SENT, RECEIVED, DROPPED) and message type
+class Counters():
+	KINDS = ("SENT", "RECEIVED", "DROPPED")
+
+	def __init__(self):
+		self.lock = _thread.allocate_lock()
+		self.counts = dict([(kind, collections.Counter()) for kind in self.KINDS])
+
+	# Count n messages of msg_type
+	def add(self, kind, msg_type, n = 1):
+		with self.lock:
+			self.counts[kind][msg_type] += n
+
+	# Return {kind: {message type: count}}
+	def snapshot(self):
+		with self.lock:
+			return dict([(kind, dict(counts)) for kind, counts in self.counts.items()])
+
+	# Reset every count to zero
+	def reset(self):
+		with self.lock:
+			for counts in self.counts.values():
+				counts.clear()
+
+
+# Structured trace messages and message counters for one component (role) of a server. A trace message
+# is one line: time, level, component, event, then KEY=value fields
+class Tracer():
+	def __init__(self, role, ID = None):
+		self.role = role
+		self.name = role if ID is None else "{} {}".format(role, ID)
+		self.counters = Counters()
+
+	# Write a trace message if level is enabled
+	def emit(self, level, event, fields):
+		if level < LEVEL:
+			return
+		line = "{:.6f} {:<7} [{}] {}".format(time.time(), LEVEL_NAMES[level], self.name, event)
+		if len(fields) > 0:
+			line += " " + " ".join(["{}={}".format(key, value) for key, value in fields.items()])
+		sys.stdout.write(line + "\n")
+
+	def error(self, event, **fields):
+		self.emit(ERROR, event, fields)
+
+	def warning(self, event, **fields):
+		self.emit(WARNING, event, fields)
+
+	def info(self, event, **fields):
+		self.emit(INFO, event, fields)
+
+	def debug(self, event, **fields):
+		self.emit(DEBUG, event, fields)
+
+	# Count n messages of msg_type sent
+	def sent(self, msg_type, n = 1):
+		self.counters.add("SENT", msg_type, n)
+
+	# Count a message of msg_type received
+	def received(self, msg_type):
+		self.counters.add("RECEIVED", msg_type)
+
+	# Count a message of msg_type dropped
+	def dropped(self, msg_type):
+		self.counters.add("DROPPED", msg_type)
+
+	# Display the message counters, and the {metric: value} of the role's worker queue if given
+	def view_counters(self, metrics = None):
+		counts = self.counters.snapshot()
+		msg_types = sorted(set([msg_type for kind in counts for msg_type in counts[kind]]))
+		print("\n{:-^120}".format(" {} MESSAGES ".format(self.name)))
+		print("{:<20} {:>12} {:>12} {:>12}".format("TYPE", *Counters.KINDS))
+		for msg_type in msg_types:
+			print("{:<20} {:>12} {:>12} {:>12}".format(msg_type, *[counts[kind].get(msg_type, 0) for kind in Counters.KINDS]))
+		if metrics is not None:
+			print("WORKER QUEUE -> {}".format("   ".join(["{}: {}".format(key, value) for key, value in metrics.items()])))
+		print("-" * 120)
@@ -0,0 +1,399 @@
+import socket
+import struct
+import _thread
+import threading
+import time
+import sys, traceback
+import wire_module
+import trace_module
+import worker_module
+
+# Transport carrying messages between servers, selected per deployment:
+# "UDP" -> one datagram per message, anything over the 4096 byte receive buffer is truncated
+# "TCP" -> length-framed messages of any size over one persistent connection per peer
+TRANSPORT = "UDP"
+
+# Stream framing: every message is preceded by its length, frames above MAX_FRAME_SIZE close the connection
+FRAME_HEADER = struct.Struct(">I")
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# Delay before reconnecting to a peer, doubled after every failed attempt up to RECONNECT_MAX_DELAY
+RECONNECT_DELAY = 0.05
+RECONNECT_MAX_DELAY = 2
+
+# Frames waiting for an unreachable peer beyond this are dropped (the protocol already tolerates lost messages)
+MAX_PENDING_FRAMES = 10000
+
+# Outbound coalescing: messages a role sends to the same peer within COALESCE_WINDOW seconds are merged into
+# one bundle of at most the transport's bundle budget, receivers split bundles back into messages. A window
+# of 0 only merges the messages queued while the previous bundles were being sent
+COALESCING = True
+COALESCE_WINDOW = 0.0005
+
+# Bundle budgets: a datagram bundle fits an Ethernet MTU, a stream bundle is only bounded to keep frames small
+DATAGRAM_BUNDLE_BUDGET = 1400
+STREAM_BUNDLE_BUDGET = 64 * 1024
+
+# Return the transport for kind ("UDP" or "TCP")
+def create_transport(kind = TRANSPORT):
+	if kind == "UDP":
+		return DatagramTransport()
+	elif kind == "TCP":
+		return StreamTransport()
+	raise ValueError("Unknown transport {}".format(kind))
+
+# Return what a role sends its messages through: a coalescer over transport, or transport itself
+def create_outbound(transport, coalescing = COALESCING):
+	if coalescing:
+		return Coalescer(transport)
+	return transport
+
+
+# Datagram Transport: one UDP datagram per message
+class DatagramTransport():
+	stream = False
+	bundle_budget = DATAGRAM_BUNDLE_BUDGET
+
+	def __init__(self):
+		# Persistent Sending Socket
+		self.send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # UDP
+
+	# Send data to address (IP, port)
+	def send(self, data, address):
+		self.send_sock.sendto(data, address)
+
+	# Send the same data to every address, an unreachable address does not stop the others
+	def broadcast(self, data, addresses):
+		for address in addresses:
+			try:
+				self.send_sock.sendto(data, address)
+			except OSError:
+				pass
+
+	# Receive datagrams on port on a listening thread, calling dispatch(msg, source) for each
+	def serve(self, port, dispatch):
+		_thread.start_new_thread(self.listen, (port, dispatch))
+
+	# Listen for incoming datagrams by binding to the port specified in the hosts file
+	def listen(self, port, dispatch):
+		try:
+			sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # UDP
+			sock.bind(('', port))
+			while True:
+				data, source = sock.recvfrom(4096)
+				for msg in wire_module.unbundle(data):
+					dispatch(msg, source)
+
+		except:
+			traceback.print_exc(file=sys.stdout)
+			# Restart listening thread
+			_thread.start_new_thread(self.listen, (port, dispatch))
+
+
+# Stream Transport: length-framed messages over one persistent TCP connection per peer
+class StreamTransport():
+	stream = True
+	bundle_budget = STREAM_BUNDLE_BUDGET
+
+	def __init__(self):
+		# Outgoing connection for each peer address
+		self.lock = _thread.allocate_lock()
+		self.connections = dict()
+
+	# Queue data for address (IP, port), written by the connection's writer thread
+	def send(self, data, address):
+		self.get_connection(address).send(FRAME_HEADER.pack(len(data)), data)
+
+	# Queue the same frame (header and data shared, not copied) for every address
+	def broadcast(self, data, addresses):
+		header = FRAME_HEADER.pack(len(data))
+		for address in addresses:
+			self.get_connection(address).send(header, data)
+
+	# Return the connection to address, opened on first use
+	def get_connection(self, address):
+		with self.lock:
+			if address not in self.connections:
+				self.connections[address] = Connection(address)
+			return self.connections[address]
+
+	# Accept connections on port on a listening thread, calling dispatch(msg, source) for each frame received
+	def serve(self, port, dispatch):
+		server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		server.bind(('', port))
+		server.listen()
+		_thread.start_new_thread(self.accept, (server, dispatch))
+
+	# Start a reading thread for every incoming connection
+	def accept(self, server, dispatch):
+		while True:
+			sock, source = server.accept()
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			_thread.start_new_thread(self.read_frames, (sock, source, dispatch))
+
+	# Read frames from a connection until the peer closes it
+	def read_frames(self, sock, source, dispatch):
+		stream = sock.makefile("rb")
+		try:
+			while True:
+				header = stream.read(FRAME_HEADER.size)
+				if len(header) < FRAME_HEADER.size:
+					break
+				length, = FRAME_HEADER.unpack(header)
+				if length > MAX_FRAME_SIZE:
+					print("[TRANSPORT] Closing connection from {}:{}, frame of {} bytes".format(source[0], source[1], length))
+					break
+				data = stream.read(length)
+				if len(data) < length:
+					break
+				for msg in wire_module.unbundle(data):
+					dispatch(msg, source)
+		except OSError:
+			pass
+		finally:
+			stream.close()
+			sock.close()
+
+
+# Outgoing connection to one peer. Messages are queued and a writer thread sends everything queued since
+# its last write in a single call (write coalescing), reconnecting with backoff when the connection breaks
+class Connection():
+	def __init__(self, address):
+		self.address = address
+		self.condition = threading.Condition()
+		self.pending = []
+		self.sock = None
+		self.reconnect_delay = RECONNECT_DELAY
+
+		# Start the writer thread
+		_thread.start_new_thread(self.writer, ())
+
+	# Queue one frame (a header and a message in pending)
+	def send(self, header, data):
+		with self.condition:
+			if len(self.pending) >= 2 * MAX_PENDING_FRAMES:
+				return
+			self.pending.append(header)
+			self.pending.append(data)
+			self.condition.notify()
+
+	# Writer thread: send every queued frame at once, dropping them if the peer cannot be reached
+	def writer(self):
+		while True:
+			with self.condition:
+				while len(self.pending) == 0:
+					self.condition.wait()
+				frames, self.pending = self.pending, []
+
+			try:
+				if self.sock is None:
+					self.connect()
+				self.sock.sendall(b"".join(frames))
+			except OSError:
+				# Frames in a broken connection are lost, like datagrams to an unreachable peer
+				self.close()
+				time.sleep(self.reconnect_delay)
+				self.reconnect_delay = min(self.reconnect_delay * 2, RECONNECT_MAX_DELAY)
+
+	# Open the connection to the peer
+	def connect(self):
+		self.sock = socket.create_connection(self.address, timeout = RECONNECT_MAX_DELAY)
+		self.sock.settimeout(None)
+		self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.reconnect_delay = RECONNECT_DELAY
+
+	# Close a broken connection, the next write reconnects
+	def close(self):
+		if self.sock is not None:
+			self.sock.close()
+			self.sock = None
+
+
+# Outbound coalescer of one role: messages for the same peer are queued and a flushing thread sends everything
+# queued for that peer after COALESCE_WINDOW seconds as one bundle. A message that would push a peer's bundle
+# past the budget sends that bundle at once, so bundles stay under the budget and messages to a peer in order
+class Coalescer():
+	def __init__(self, transport, window = COALESCE_WINDOW):
+		self.transport = transport
+		self.window = window
+		self.budget = transport.bundle_budget
+		self.condition = threading.Condition()
+
+		# Peer address -> (encoded messages, bundle size)
+		self.pending = dict()
+
+		# Start the flushing thread
+		_thread.start_new_thread(self.flusher, ())
+
+	# Queue data for address (IP, port)
+	def send(self, data, address):
+		with self.condition:
+			ready = self.queue(data, address)
+			self.condition.notify()
+		self.send_ready(ready)
+
+	# Queue the same data for every address
+	def broadcast(self, data, addresses):
+		ready = []
+		with self.condition:
+			for address in addresses:
+				ready += self.queue(data, address)
+			self.condition.notify()
+		self.send_ready(ready)
+
+	# Add data to the bundle for address. Return the [(messages, address)] to send now: the bundle if data
+	# does not fit in it, and data itself if it does not fit in any bundle (caller holds the condition)
+	def queue(self, data, address):
+		ready = []
+		messages, size = self.pending.get(address, ([], wire_module.BUNDLE_HEADER_SIZE))
+		item_size = len(data) + wire_module.BUNDLE_ITEM_SIZE
+		if (len(messages) > 0) and (size + item_size > self.budget):
+			ready.append((messages, address))
+			messages, size = [], wire_module.BUNDLE_HEADER_SIZE
+		if size + item_size > self.budget:
+			ready.append(([data], address))
+			self.pending.pop(address, None)
+		else:
+			messages.append(data)
+			self.pending[address] = (messages, size + item_size)
+		return ready
+
+	# Send [(messages, address)], a single message is sent as is
+	def send_ready(self, ready):
+		for messages, address in ready:
+			try:
+				if len(messages) == 1:
+					self.transport.send(messages[0], address)
+				else:
+					self.transport.send(wire_module.encode_bundle(messages), address)
+			except OSError:
+				pass
+
+	# Flushing thread: once messages are queued, wait out the window then send every peer's bundle
+	def flusher(self):
+		while True:
+			with self.condition:
+				while len(self.pending) == 0:
+					self.condition.wait()
+			if self.window > 0:
+				time.sleep(self.window)
+			with self.condition:
+				pending, self.pending = self.pending, dict()
+			self.send_ready([(messages, address) for address, (messages, size) in pending.items()])
+
+
+# Messaging shared by the proposer, acceptor and learner of a server: serving the role's port, dropping messages
+# on request, decoding what is received and sending to one peer or to every server's proposers, acceptors or
+# learners. A role implements process_message(msg, source), and handle_datagram when it replies asynchronously
+class Role():
+	def __init__(self, name, ID, server_config, local_run = False, transport = None):
+		# Number of messages for the listening thread to drop (used for debug purposes)
+		self.drop_counter = 0
+
+		# Trace messages and counts of messages sent, received and dropped
+		self.tracer = trace_module.Tracer(name, ID)
+
+		# Transport sending (and without a runtime, receiving) messages, UDP unless the deployment selects another
+		if transport is None:
+			transport = DatagramTransport()
+		self.transport = transport
+
+		# Outgoing messages for the same peer are coalesced into bundles
+		self.outbound = create_outbound(transport)
+
+		# Addresses of every server's proposer, acceptor and learner, messages to all of them are encoded once
+		self.broadcast_addresses = dict()
+		for port in ["PROPOSER_PORT", "ACCEPTOR_PORT", "LEARNER_PORT"]:
+			self.broadcast_addresses[port] = [(server_config[server]["IP"], server_config[server][port]) for server in server_config]
+		if local_run:
+			self.broadcast_addresses["LEARNER_PORT"].append(('127.0.0.1', 9023))
+
+		# Worker pool processing received messages, None when served by the node runtime
+		self.workers = None
+
+	# Serve incoming messages on port: on the node runtime's event loop if given, otherwise on the transport's
+	# thread handing them to a bounded pool of worker threads that sheds shed_order first when full
+	def serve(self, port, runtime = None, shed_order = ()):
+		if runtime is not None:
+			runtime.register(self, port)
+		else:
+			self.workers = worker_module.WorkerPool(self.process_message, shed_order = shed_order, on_drop = self.tracer.dropped)
+			self.transport.serve(port, self.dispatch)
+
+	# Handle one message received by the transport's listening thread
+	def dispatch(self, msg, source):
+		if self.drop_requested(msg):
+			return
+
+		# Queue message for the worker pool
+		self.workers.submit(msg, source)
+
+	# Coroutine handling one datagram received by the node runtime, runs on the event loop without a thread
+	async def handle_datagram(self, msg, source):
+		if self.drop_requested(msg):
+			return
+
+		self.process_message(msg, source)
+
+	# Return True if the user asked for msg to be dropped (used for debug purposes)
+	def drop_requested(self, msg):
+		if self.drop_counter > 0:
+			self.drop_counter -= 1
+			self.tracer.dropped(wire_module.peek_type(msg))
+			return True
+		return False
+
+	# Decode and count a received message, return None (counted as MALFORMED) if it is not a valid message
+	def decode(self, msg, source):
+		try:
+			msg = wire_module.decode(msg)
+		except wire_module.WireError as e:
+			self.tracer.dropped("MALFORMED")
+			if trace_module.DEBUG_ENABLED:
+				self.tracer.debug("MALFORMED", SOURCE = "{}:{}".format(source[0], source[1]), ERROR = e)
+			return None
+
+		self.tracer.received(msg["TYPE"])
+		if trace_module.DEBUG_ENABLED:
+			self.tracer.debug("RECEIVED", TYPE = msg["TYPE"], SOURCE = "{}:{}".format(source[0], source[1]))
+		return msg
+
+	# Given a destination IP and port, send a message
+	def send_msg(self, dest_ip, dest_port, message):
+		try:
+			msg = wire_module.encode(message)
+			self.outbound.send(msg, (dest_ip, dest_port))
+		except:
+			self.tracer.dropped(message["TYPE"])
+			return
+		self.tracer.sent(message["TYPE"])
+		if trace_module.DEBUG_ENABLED:
+			self.tracer.debug("SENT", TYPE = message["TYPE"], DESTINATION = "{}:{}".format(dest_ip, dest_port))
+
+	# Encode a message once and send it to every (IP, port) in addresses
+	def broadcast(self, addresses, message, description):
+		try:
+			self.outbound.broadcast(wire_module.encode(message), addresses)
+		except:
+			self.tracer.dropped(message["TYPE"])
+			return
+		self.tracer.sent(message["TYPE"], len(addresses))
+		if trace_module.DEBUG_ENABLED:
+			self.tracer.debug("SENT", TYPE = message["TYPE"], DESTINATION = description)
+
+	# Send message to all proposers (including self)
+	def send_all_proposers(self, message):
+		self.broadcast(self.broadcast_addresses["PROPOSER_PORT"], message, "ALL PROPOSERS")
+
+	# Send message to all acceptors
+	def send_all_acceptors(self, message):
+		self.broadcast(self.broadcast_addresses["ACCEPTOR_PORT"], message, "ALL ACCEPTORS")
+
+	# Send message to all learners
+	def send_all_learners(self, message):
+		self.broadcast(self.broadcast_addresses["LEARNER_PORT"], message, "ALL LEARNERS")
+
+	# Drop the requested number of messages in the listening thread
+	def drop_messages(self, num_messages):
+		self.drop_counter = num_messages
@@ -0,0 +1,138 @@
+import os
+import pickle
+import _thread
+import threading
+import heapq
+import concurrent.futures
+
+# Write-Ahead Log Class: append-only file of pickled records. Any thread may append; a single writer thread
+# writes everything queued since its last pass and issues one flush+fsync for the whole group (group commit)
+class WriteAheadLog():
+	def __init__(self, filename):
+		self.filename = filename
+
+		# Records waiting for the writer thread, sequence numbers of the last appended/durable records
+		self.lock = _thread.allocate_lock()
+		self.condition = threading.Condition(self.lock)
+		self.pending = []
+		self.appended = 0
+		self.durable = 0
+
+		# Heap of (sequence number, tie breaker, future) resolved once the sequence number is durable
+		self.waiters = []
+		self.waiter_count = 0
+
+		# Number of records in the file (used to decide when to compact)
+		self.records = 0
+
+		# Held by the writer while it owns the file, so compaction never interleaves with a write
+		self.file_lock = _thread.allocate_lock()
+		self.file = open(filename, "ab")
+
+		# Start the group commit thread
+		_thread.start_new_thread(self.writer, ())
+
+	# Queue a record and return its sequence number
+	def append(self, record):
+		data = pickle.dumps(record)
+		with self.condition:
+			self.pending.append(data)
+			self.appended += 1
+			self.records += 1
+			self.condition.notify_all()
+			return self.appended
+
+	# Return the sequence number of the last appended record
+	def last_sequence(self):
+		with self.lock:
+			return self.appended
+
+	# Return a Future resolved once every record up to seq is on disk
+	def wait_future(self, seq):
+		future = concurrent.futures.Future()
+		with self.lock:
+			if seq <= self.durable:
+				future.set_result(seq)
+			else:
+				self.waiter_count += 1
+				heapq.heappush(self.waiters, (seq, self.waiter_count, future))
+		return future
+
+	# Block until every record up to seq is on disk
+	def wait(self, seq):
+		self.wait_future(seq).result()
+
+	# Group commit thread: write all pending records at once, fsync, then release their waiters
+	def writer(self):
+		while True:
+			with self.condition:
+				while len(self.pending) == 0:
+					self.condition.wait()
+
+			with self.file_lock:
+				# A compaction may have absorbed the pending records in the meantime
+				with self.condition:
+					batch, self.pending = self.pending, []
+					seq = self.appended
+				if len(batch) == 0:
+					continue
+
+				self.file.write(b"".join(batch))
+				self.file.flush()
+				os.fsync(self.file.fileno())
+
+				self.mark_durable(seq)
+
+	# Record that everything up to seq is on disk and resolve the matching waiters
+	def mark_durable(self, seq):
+		with self.lock:
+			self.durable = max(self.durable, seq)
+			while (len(self.waiters) > 0) and (self.waiters[0][0] <= self.durable):
+				heapq.heappop(self.waiters)[2].set_result(self.durable)
+
+	# Replace the whole file with a compacted copy of the current state. snapshot() returns (records, seq), the
+	# state's records and the sequence number of the last append they reflect. It runs with the writer paused
+	# and only needs to be atomic with the appends, records appended after it are kept for the new file
+	def rewrite(self, snapshot):
+		with self.file_lock:
+			records, seq = snapshot()
+			with self.lock:
+				# Pending records are the latest appended ones, drop those the snapshot reflects
+				newer = self.appended - seq
+				self.pending = self.pending[len(self.pending) - newer:] if newer > 0 else []
+
+			# Write the compacted copy next to the log, then atomically swap it in
+			temp_filename = self.filename + ".tmp"
+			f = open(temp_filename, "wb")
+			for record in records:
+				pickle.dump(record, f)
+			f.flush()
+			os.fsync(f.fileno())
+			f.close()
+
+			self.file.close()
+			os.replace(temp_filename, self.filename)
+			self.file = open(self.filename, "ab")
+			with self.lock:
+				self.records = len(records) + len(self.pending)
+
+			self.mark_durable(seq)
+
+
+# Return every record stored in a write-ahead log file, stopping at a torn record left by a crash
+def read_records(filename):
+	records = []
+	if not os.path.isfile(filename):
+		return records
+
+	f = open(filename, "rb")
+	while True:
+		try:
+			records.append(pickle.load(f))
+		except EOFError:
+			break
+		except (pickle.UnpicklingError, ValueError, AttributeError, IndexError):
+			print("[WAL] Ignoring torn record at the end of {}".format(filename))
+			break
+	f.close()
+	return records
@@ -0,0 +1,44 @@
+import sys
+import pickle
+import timeit
+import wire_module
+from event_module import *
+
+# Microbenchmark of the binary wire protocol against the previous pickle encoding: bytes per message and
+# nanoseconds per encode/decode for each message type
+# Usage: python wire_benchmark.py [iterations]
+
+# Representative message of each type
+def sample_messages():
+	tweet = Tweet("Andrew", "Paxos keeps every replica of the timeline consistent")
+	block = InsertBlock("Andrew", "Mallory")
+	batch = Batch("Andrew", [Tweet("Andrew", "batched tweet {}".format(i)) for i in range(8)] + [DeleteBlock("Andrew", "Mallory")])
+	return [\
+	("PROPOSE", {"TYPE": "PROPOSE", "SLOT": 1024, "N": (3, 1), "ID": 1}), \
+	("PROMISE", {"TYPE": "PROMISE", "SLOT": 1024, "N": (3, 1), "ACC_NUM": (2, 2), "ACC_VAL": tweet, "ID": 2}), \
+	("ACCEPT", {"TYPE": "ACCEPT", "SLOT": 1024, "N": (3, 1), "EVENT": tweet, "ID": 1}), \
+	("ACK", {"TYPE": "ACK", "SLOT": 1024, "N": (3, 1), "ACC_NUM": (3, 1), "ACC_VAL": tweet, "ID": 2}), \
+	("COMMIT (Tweet)", {"TYPE": "COMMIT", "SLOT": 1024, "EVENT": tweet, "ID": 1}), \
+	("COMMIT (InsertBlock)", {"TYPE": "COMMIT", "SLOT": 1025, "EVENT": block, "ID": 1}), \
+	("COMMIT (Batch)", {"TYPE": "COMMIT", "SLOT": 1026, "EVENT": batch, "ID": 1})]
+
+# Return the average nanoseconds per call of function over iterations calls
+def time_ns(function, iterations):
+	return timeit.timeit(function, number = iterations) / iterations * 1e9
+
+if __name__ == "__main__":
+	iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+	print("{:-^120}".format("WIRE PROTOCOL BENCHMARK"))
+	print("{:<22} {:>10} {:>10} {:>14} {:>14} {:>14} {:>14}".format("MESSAGE", "PICKLE B", "WIRE B", "PICKLE ENC ns", "WIRE ENC ns", "PICKLE DEC ns", "WIRE DEC ns"))
+	for name, msg in sample_messages():
+		pickled = pickle.dumps(msg)
+		encoded = wire_module.encode(msg)
+		assert wire_module.decode(encoded).keys() == msg.keys()
+
+		pickle_encode = time_ns(lambda: pickle.dumps(msg), iterations)
+		wire_encode = time_ns(lambda: wire_module.encode(msg), iterations)
+		pickle_decode = time_ns(lambda: pickle.loads(pickled), iterations)
+		wire_decode = time_ns(lambda: wire_module.decode(encoded), iterations)
+		print("{:<22} {:>10} {:>10} {:>14.0f} {:>14.0f} {:>14.0f} {:>14.0f}".format(name, len(pickled), len(encoded), pickle_encode, wire_encode, pickle_decode, wire_decode))
+	print("-" * 120)
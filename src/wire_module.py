@@ -0,0 +1,339 @@
+import struct
+from event_module import *
+
+# Binary wire protocol for the messages exchanged between proposers, acceptors and learners.
+# Every datagram starts with the protocol version and the message type followed by the fixed-size fields
+# of that type's schema, all packed with a single struct, then its variable fields (events, accepted
+# values, catch-up payloads) in a tagged value encoding. The value encoding only knows the types below,
+# so decoding never constructs arbitrary objects the way pickle does
+WIRE_VERSION = 1
+
+# Field kinds:
+# SLOT   -> signed 64 bit integer
+# ID     -> signed 32 bit integer (server ID)
+# BALLOT -> (round, server ID) or None, packed as a presence byte, round and server ID
+# VALUE  -> tagged value
+SLOT = "q"
+ID = "i"
+BALLOT = "Bqi"
+VALUE = None
+
+# Message type -> (type code, [(field, kind)]). Codes are part of the protocol, never reuse one
+SCHEMAS = {\
+"TEST" : (0, []), \
+"PROPOSE" : (1, [("SLOT", SLOT), ("N", BALLOT), ("ID", ID)]), \
+"PROMISE" : (2, [("SLOT", SLOT), ("N", BALLOT), ("ACC_NUM", BALLOT), ("ID", ID), ("ACC_VAL", VALUE)]), \
+"ACCEPT" : (3, [("SLOT", SLOT), ("N", BALLOT), ("ID", ID), ("EVENT", VALUE)]), \
+"ACK" : (4, [("SLOT", SLOT), ("N", BALLOT), ("ACC_NUM", BALLOT), ("ID", ID), ("ACC_VAL", VALUE)]), \
+"COMMIT" : (5, [("SLOT", SLOT), ("ID", ID), ("EVENT", VALUE)]), \
+"PROPOSE_ALL" : (6, [("SLOT", SLOT), ("N", BALLOT), ("ID", ID)]), \
+"PROMISE_ALL" : (7, [("SLOT", SLOT), ("N", BALLOT), ("ID", ID), ("ACCEPTED", VALUE)]), \
+"WATERMARK" : (8, [("SLOT", SLOT), ("ID", ID)]), \
+"CATCHUP_REQUEST" : (9, [("SLOT", SLOT), ("ID", ID), ("END", VALUE)]), \
+"CATCHUP_ENTRIES" : (10, [("ID", ID), ("ENTRIES", VALUE)]), \
+"CATCHUP_DONE" : (11, [("SLOT", SLOT), ("N", BALLOT), ("END", SLOT), ("PREFIX", SLOT), ("ID", ID)]), \
+"CATCHUP_STATE" : (12, [("SLOT", SLOT), ("CHUNK", SLOT), ("CHUNKS", SLOT), ("ID", ID), ("DATA", VALUE)]), \
+"BUNDLE" : (13, [("MESSAGES", VALUE)]), \
+"NACK" : (14, [("SLOT", SLOT), ("N", BALLOT), ("MAX_PREPARE", BALLOT), ("ID", ID)]), \
+"HEARTBEAT" : (15, [("ID", ID)]), \
+"FORWARD" : (16, [("SEQ", SLOT), ("ID", ID), ("EVENT", VALUE)]), \
+"FORWARD_RESULT" : (17, [("SEQ", SLOT), ("ID", ID), ("RESULT", VALUE)])}
+
+# Value tags
+NONE = 0
+FALSE = 1
+TRUE = 2
+INT = 3
+FLOAT = 4
+STR = 5
+BYTES = 6
+TUPLE = 7
+LIST = 8
+DICT = 9
+SET = 10
+TWEET = 11
+INSERT_BLOCK = 12
+DELETE_BLOCK = 13
+BATCH = 14
+NOOP = 15
+FORWARDED = 16
+
+TAG = struct.Struct("<B")
+INT_VALUE = struct.Struct("<Bq")
+FLOAT_VALUE = struct.Struct("<Bd")
+LENGTH = struct.Struct("<BI")
+
+# Bundle: several encoded messages for the same peer carried in one datagram (or frame) as a list of bytes.
+# Sizes of the bundle's header and of the length prefix added to every message in it
+BUNDLE_HEADER_SIZE = 2 + LENGTH.size
+BUNDLE_ITEM_SIZE = LENGTH.size
+
+# Events: tag, then the byte lengths of their strings (and a Tweet's timestamp), then the strings
+TWEET_HEADER = struct.Struct("<BIIdI")
+BLOCK_HEADER = struct.Struct("<BII")
+
+# Raised for a datagram that is not a valid message of this protocol version
+class WireError(ValueError):
+	pass
+
+
+# Compiled schema of a message type: the struct packing the header and fixed-size fields, the fixed-size
+# fields in order and the names of the variable fields that follow them
+class Schema():
+	def __init__(self, msg_type, code, fields):
+		self.msg_type = msg_type
+		self.code = code
+		self.fixed = [(field, kind) for field, kind in fields if kind is not VALUE]
+		self.values = [field for field, kind in fields if kind is VALUE]
+		self.header = struct.Struct("<BB" + "".join([kind for field, kind in self.fixed]))
+
+# Message type -> Schema, type code -> Schema
+ENCODERS = dict()
+DECODER_SCHEMAS = dict()
+for msg_type, (code, fields) in SCHEMAS.items():
+	ENCODERS[msg_type] = Schema(msg_type, code, fields)
+	DECODER_SCHEMAS[code] = ENCODERS[msg_type]
+
+
+# Encode a message dict into bytes
+def encode(msg):
+	try:
+		schema = ENCODERS[msg["TYPE"]]
+	except KeyError:
+		raise WireError("Unknown message type {}".format(msg.get("TYPE")))
+
+	args = [WIRE_VERSION, schema.code]
+	for field, kind in schema.fixed:
+		if kind is BALLOT:
+			ballot = msg[field]
+			if ballot is None:
+				args += (0, 0, 0)
+			else:
+				args += (1, ballot[0], ballot[1])
+		else:
+			args.append(msg[field])
+
+	parts = [schema.header.pack(*args)]
+	for field in schema.values:
+		encode_value(msg[field], parts)
+	return b"".join(parts)
+
+# Decode bytes produced by encode back into a message dict
+def decode(data):
+	data = bytes(data)
+	if len(data) < 2:
+		raise WireError("Truncated message")
+	if data[0] != WIRE_VERSION:
+		raise WireError("Unsupported wire protocol version {}".format(data[0]))
+	schema = DECODER_SCHEMAS.get(data[1])
+	if schema is None:
+		raise WireError("Unknown message type code {}".format(data[1]))
+
+	msg = {"TYPE": schema.msg_type}
+	try:
+		fields = schema.header.unpack_from(data, 0)
+		i = 2
+		for field, kind in schema.fixed:
+			if kind is BALLOT:
+				msg[field] = (fields[i + 1], fields[i + 2]) if fields[i] else None
+				i += 3
+			else:
+				msg[field] = fields[i]
+				i += 1
+
+		offset = schema.header.size
+		for field in schema.values:
+			msg[field], offset = DECODERS[data[offset]](data, offset)
+	except (struct.error, IndexError, KeyError, UnicodeDecodeError, TypeError, RecursionError) as e:
+		raise WireError("Malformed {} message: {!r}".format(schema.msg_type, e))
+
+	if offset != len(data):
+		raise WireError("{} trailing bytes after {} message".format(len(data) - offset, schema.msg_type))
+
+	# A bundle only carries encoded messages
+	if (schema.msg_type == "BUNDLE") and \
+	((type(msg["MESSAGES"]) is not list) or (not all([type(item) is bytes for item in msg["MESSAGES"]]))):
+		raise WireError("BUNDLE message carries a value that is not an encoded message")
+	return msg
+
+# Return the message type of encoded data without decoding it ("UNKNOWN" if it is not a valid message)
+def peek_type(data):
+	if (len(data) < 2) or (data[0] != WIRE_VERSION) or (data[1] not in DECODER_SCHEMAS):
+		return "UNKNOWN"
+	return DECODER_SCHEMAS[data[1]].msg_type
+
+
+# Encode a list of encoded messages into one bundle
+def encode_bundle(messages):
+	return encode({"TYPE": "BUNDLE", "MESSAGES": messages})
+
+# Return the encoded messages carried by data: those of a bundle, otherwise data itself. A malformed bundle
+# (one carrying anything but bytes too) is returned as is, for the receiving role to count it as a malformed message
+def unbundle(data):
+	if (len(data) < 2) or (data[1] != ENCODERS["BUNDLE"].code) or (data[0] != WIRE_VERSION):
+		return [data]
+	try:
+		return decode(data)["MESSAGES"]
+	except WireError:
+		return [data]
+
+
+# Append the tagged encoding of value to parts (returns the encoded bytes when parts is not given)
+def encode_value(value, parts = None):
+	if parts is None:
+		parts = []
+		encode_value(value, parts)
+		return b"".join(parts)
+
+	value_type = type(value)
+	if value_type is Tweet:
+		username = value.username.encode("utf-8")
+		message = value.message.encode("utf-8")
+		utc_time = value.utc_time.encode("utf-8")
+		parts.append(TWEET_HEADER.pack(TWEET, len(username), len(message), value.get_timestamp(), len(utc_time)))
+		parts += (username, message, utc_time)
+	elif (value_type is InsertBlock) or (value_type is DeleteBlock):
+		username = value.username.encode("utf-8")
+		follower = value.follower.encode("utf-8")
+		parts.append(BLOCK_HEADER.pack(INSERT_BLOCK if value_type is InsertBlock else DELETE_BLOCK, len(username), len(follower)))
+		parts += (username, follower)
+	elif value is None:
+		parts.append(TAG.pack(NONE))
+	elif value_type is NoOp:
+		parts.append(TAG.pack(NOOP))
+	elif value_type is Forwarded:
+		parts.append(TAG.pack(FORWARDED))
+		encode_value(value.key, parts)
+		encode_value(value.event, parts)
+	elif value_type is bool:
+		parts.append(TAG.pack(TRUE if value else FALSE))
+	elif value_type is int:
+		parts.append(INT_VALUE.pack(INT, value))
+	elif value_type is float:
+		parts.append(FLOAT_VALUE.pack(FLOAT, value))
+	elif value_type is str:
+		data = value.encode("utf-8")
+		parts.append(LENGTH.pack(STR, len(data)))
+		parts.append(data)
+	elif value_type is bytes:
+		parts.append(LENGTH.pack(BYTES, len(value)))
+		parts.append(value)
+	elif value_type is Batch:
+		username = value.username.encode("utf-8")
+		parts.append(LENGTH.pack(BATCH, len(username)))
+		parts.append(username)
+		encode_value(value.events, parts)
+	elif (value_type is tuple) or (value_type is list) or (value_type is set):
+		parts.append(LENGTH.pack(TUPLE if value_type is tuple else (LIST if value_type is list else SET), len(value)))
+		for item in value:
+			encode_value(item, parts)
+	elif value_type is dict:
+		parts.append(LENGTH.pack(DICT, len(value)))
+		for key, item in value.items():
+			encode_value(key, parts)
+			encode_value(item, parts)
+	else:
+		raise WireError("Cannot encode value of type {}".format(value_type.__name__))
+
+# Return the value encoded by encode_value
+def decode_value(data):
+	data = bytes(data)
+	try:
+		value, offset = DECODERS[data[0]](data, 0)
+	except (struct.error, IndexError, KeyError, UnicodeDecodeError, TypeError, RecursionError) as e:
+		raise WireError("Malformed value: {!r}".format(e))
+	if offset != len(data):
+		raise WireError("{} trailing bytes after value".format(len(data) - offset))
+	return value
+
+
+# Decoders: return the value whose tag is at offset and the offset following it
+
+# Return length bytes from offset, refusing to read past the end of data
+def read_bytes(data, offset, length):
+	end = offset + length
+	if end > len(data):
+		raise WireError("Truncated value")
+	return data[offset:end], end
+
+def decode_tweet(data, offset):
+	tag, username_length, message_length, timestamp, utc_time_length = TWEET_HEADER.unpack_from(data, offset)
+	username, offset = read_bytes(data, offset + TWEET_HEADER.size, username_length)
+	message, offset = read_bytes(data, offset, message_length)
+	utc_time, offset = read_bytes(data, offset, utc_time_length)
+
+	tweet = Tweet.__new__(Tweet)
+	tweet.username = username.decode("utf-8")
+	tweet.message = message.decode("utf-8")
+	tweet.timestamp = timestamp
+	tweet.utc_time = utc_time.decode("utf-8")
+	return tweet, offset
+
+def decode_block(data, offset):
+	tag, username_length, follower_length = BLOCK_HEADER.unpack_from(data, offset)
+	username, offset = read_bytes(data, offset + BLOCK_HEADER.size, username_length)
+	follower, offset = read_bytes(data, offset, follower_length)
+	return (InsertBlock if tag == INSERT_BLOCK else DeleteBlock)(username.decode("utf-8"), follower.decode("utf-8")), offset
+
+def decode_str(data, offset):
+	tag, length = LENGTH.unpack_from(data, offset)
+	value, offset = read_bytes(data, offset + LENGTH.size, length)
+	return value.decode("utf-8"), offset
+
+def decode_bytes(data, offset):
+	tag, length = LENGTH.unpack_from(data, offset)
+	return read_bytes(data, offset + LENGTH.size, length)
+
+def decode_batch(data, offset):
+	username, offset = decode_str(data, offset)
+	events, offset = DECODERS[data[offset]](data, offset)
+	return Batch(username, events), offset
+
+def decode_forwarded(data, offset):
+	offset += TAG.size
+	key, offset = DECODERS[data[offset]](data, offset)
+	event, offset = DECODERS[data[offset]](data, offset)
+
+	# The log keeps the keys it applied, an unhashable key raises TypeError (a malformed value)
+	hash(key)
+	return Forwarded(key, event), offset
+
+def decode_items(data, offset):
+	tag, length = LENGTH.unpack_from(data, offset)
+	offset += LENGTH.size
+	items = []
+	for i in range(length):
+		item, offset = DECODERS[data[offset]](data, offset)
+		items.append(item)
+	if tag == TUPLE:
+		return tuple(items), offset
+	return (items if tag == LIST else set(items)), offset
+
+def decode_dict(data, offset):
+	tag, length = LENGTH.unpack_from(data, offset)
+	offset += LENGTH.size
+	value = dict()
+	for i in range(length):
+		key, offset = DECODERS[data[offset]](data, offset)
+		value[key], offset = DECODERS[data[offset]](data, offset)
+	return value, offset
+
+# Value tag -> decoder
+DECODERS = {\
+NONE : lambda data, offset: (None, offset + 1), \
+FALSE : lambda data, offset: (False, offset + 1), \
+TRUE : lambda data, offset: (True, offset + 1), \
+INT : lambda data, offset: (INT_VALUE.unpack_from(data, offset)[1], offset + INT_VALUE.size), \
+FLOAT : lambda data, offset: (FLOAT_VALUE.unpack_from(data, offset)[1], offset + FLOAT_VALUE.size), \
+STR : decode_str, \
+BYTES : decode_bytes, \
+TUPLE : decode_items, \
+LIST : decode_items, \
+DICT : decode_dict, \
+SET : decode_items, \
+TWEET : decode_tweet, \
+INSERT_BLOCK : decode_block, \
+DELETE_BLOCK : decode_block, \
+BATCH : decode_batch, \
+NOOP : lambda data, offset: (NoOp(), offset + 1), \
+FORWARDED : decode_forwarded}
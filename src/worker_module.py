@@ -0,0 +1,78 @@
+import _thread
+import sys, traceback
+import threading
+import collections
+import wire_module
+
+# Number of worker threads processing a role's incoming messages (enough for concurrent messages waiting on
+# the same fsync to share it)
+WORKERS = 16
+
+# Messages waiting for a worker beyond this are shed according to the role's overload policy
+QUEUE_CAPACITY = 4096
+
+# Worker Pool Class: a fixed number of threads processing received messages from a bounded queue. When the
+# queue is full the oldest message of the first type in shed_order that has one queued is dropped, the oldest
+# message of any type otherwise, so memory and queueing delay stay bounded under a burst
+class WorkerPool():
+	def __init__(self, handler, workers = WORKERS, capacity = QUEUE_CAPACITY, shed_order = (), on_drop = None):
+		self.handler = handler
+		self.capacity = capacity
+		self.shed_order = shed_order
+		self.on_drop = on_drop
+		self.condition = threading.Condition()
+
+		# Queue of (message type, msg, source)
+		self.queue = collections.deque()
+
+		# Metrics: messages processed and shed, deepest the queue has been
+		self.processed = 0
+		self.shed = 0
+		self.max_depth = 0
+
+		# Start the worker threads
+		for i in range(workers):
+			_thread.start_new_thread(self.worker, ())
+
+	# Queue a received message for a worker, shedding one if the queue is full
+	def submit(self, msg, source):
+		msg_type = wire_module.peek_type(msg)
+		with self.condition:
+			dropped = None
+			if len(self.queue) >= self.capacity:
+				dropped = self.shed_one()
+			self.queue.append((msg_type, msg, source))
+			self.max_depth = max(self.max_depth, len(self.queue))
+			self.condition.notify()
+
+		if (dropped is not None) and (self.on_drop is not None):
+			self.on_drop(dropped)
+
+	# Remove a queued message according to the overload policy, return its type (caller holds the condition)
+	def shed_one(self):
+		self.shed += 1
+		for shed_type in self.shed_order:
+			for i in range(len(self.queue)):
+				if self.queue[i][0] == shed_type:
+					del self.queue[i]
+					return shed_type
+		return self.queue.popleft()[0]
+
+	# Worker thread: process queued messages in arrival order
+	def worker(self):
+		while True:
+			with self.condition:
+				while len(self.queue) == 0:
+					self.condition.wait()
+				msg_type, msg, source = self.queue.popleft()
+			try:
+				self.handler(msg, source)
+			except Exception:
+				traceback.print_exc(file=sys.stdout)
+			with self.condition:
+				self.processed += 1
+
+	# Return the queue metrics {metric: value}
+	def metrics(self):
+		with self.condition:
+			return {"DEPTH": len(self.queue), "MAX_DEPTH": self.max_depth, "CAPACITY": self.capacity, "PROCESSED": self.processed, "SHED": self.shed}